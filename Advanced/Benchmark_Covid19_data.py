@@ -0,0 +1,524 @@
+#
+# Offline benchmarks for the loaders in Get_Covid19_data.py
+#
+# The real sources (GitHub, census.gov, worldbank.org) change every day and are slow to reach, so timing
+# against them says little. Here synthetic NYT, JHU, census and country code files are generated at a
+# chosen scale (days x regions), written to a temporary directory, and served from a local HTTP server.
+# The Source_URLs and NYT_base_url are pointed at that server while the benchmarks run, so the full
+# download -> parse -> cache path of each loader is measured, without ever touching the network.
+#
+# The wall time, bytes, rows and peak memory come from the profiler in Get_Covid19_data.
+#
+# Usage:
+#    python Benchmark_Covid19_data.py --days 300 --counties 3000 --countries 200 --json bench.json
+#
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+import Get_Covid19_data as covid
+
+
+#
+# Synthetic fixtures.
+# All generators take a numpy Generator, so the same seed gives the same files.
+#
+def Make_States(n_states=50):
+    """Return a table of synthetic states with name, abbreviation, fips code, census region and division."""
+    n_states = min(n_states, 56)
+    state = np.arange(1, n_states + 1)
+    return pd.DataFrame({"state": ["State {:02d}".format(s) for s in state],
+                         "st": ["S{:02d}".format(s) for s in state],
+                         "STATE": state,
+                         "REGION": 1 + (state - 1) % 4,
+                         "DIVISION": 1 + (state - 1) % 9})
+
+
+def Make_Counties(states, n_counties=3000):
+    """Return a table of synthetic counties, spread evenly over the states, with name and 5 digit fips code."""
+    per_state = int(np.ceil(n_counties/len(states)))
+    if per_state > 997:
+        raise ValueError("At most 997 counties per state fit in a fips code, use more states.")
+    state_index = np.arange(n_counties) // per_state
+    county = np.arange(n_counties) % per_state + 1
+    counties = states.iloc[state_index].reset_index(drop=True)
+    counties["COUNTY"] = county
+    counties["county"] = ["County {:03d}".format(c) for c in county]
+    counties["fips"] = pd.Series(counties["STATE"]*1000 + county).astype(str).str.zfill(5)
+    return counties
+
+
+def Make_Dates(days, start="2020-01-22"):
+    """Return the list of days dates, starting at start."""
+    return pd.date_range(start, periods=days, freq="D")
+
+
+def _cumulative_counts(rng, days, n, scale):
+    """Return (days, n) arrays with cumulative cases and deaths, which only go up, like the real data."""
+    rate = rng.gamma(1.0, scale, size=n)
+    cases = np.cumsum(rng.poisson(rate, size=(days, n)), axis=0)
+    deaths = cases//50 + np.cumsum(rng.poisson(rate/200, size=(days, n)), axis=0)
+    return cases, deaths
+
+
+def Make_Abbrevs_Fixture(states):
+    """Return the contents of the name->abbreviation and abbreviation->name json files."""
+    name_abbr = json.dumps(dict(zip(states["state"], states["st"]))).encode()
+    abbr_name = json.dumps(dict(zip(states["st"], states["state"]))).encode()
+    return name_abbr, abbr_name
+
+
+def Make_Census_Fixture(rng, states, counties, extra_years=range(2010, 2019)):
+    """Return the contents of a census file like co-est2019-alldata.csv, with a row for each state
+    (COUNTY=0, SUMLEV=40) and for each county (SUMLEV=50). The extra_years add the POPESTIMATE columns of the
+    other years, so the file has a more realistic width."""
+    state_rows = states.assign(COUNTY=0, SUMLEV=40, CTYNAME=states["state"])
+    county_rows = counties.assign(SUMLEV=50, CTYNAME=counties["county"])
+    census = pd.concat([state_rows, county_rows], ignore_index=True)
+    census = census.rename(columns={"state": "STNAME"}).sort_values(["STATE", "COUNTY"], kind="stable")
+    census = census[["SUMLEV", "REGION", "DIVISION", "STATE", "COUNTY", "STNAME", "CTYNAME"]]
+    pop = rng.integers(1000, 1000000, size=len(census))
+    census["CENSUS2010POP"] = pop
+    for year in extra_years:
+        census["POPESTIMATE{}".format(year)] = pop + rng.integers(-500, 500, size=len(census))
+    census["POPESTIMATE2019"] = pop + rng.integers(-1000, 1000, size=len(census))
+    return census.to_csv(index=False).encode("ISO-8859-1")
+
+
+def Make_NYT_Fixture(rng, states, counties, days):
+    """Return the contents of the NYT us-states.csv and us-counties.csv for days days, with every region
+    reporting every day. Each state also gets an "Unknown" county without a fips code, like the real data."""
+    dates = Make_Dates(days).strftime("%Y-%m-%d")
+    unknown = states.assign(county="Unknown", fips="")
+    places = pd.concat([counties[["county", "state", "fips"]], unknown[["county", "state", "fips"]]],
+                       ignore_index=True)
+
+    cases, deaths = _cumulative_counts(rng, days, len(places), 5.0)
+    data_counties = pd.DataFrame({"date": np.repeat(dates, len(places)),
+                                  "county": np.tile(places["county"].values, days),
+                                  "state": np.tile(places["state"].values, days),
+                                  "fips": np.tile(places["fips"].values, days),
+                                  "cases": cases.ravel(), "deaths": deaths.ravel()})
+
+    # The state numbers are the sums of the counties, as in the real data.
+    data_states = data_counties.groupby(["date", "state"], as_index=False, sort=False)[["cases", "deaths"]].sum()
+    data_states.insert(2, "fips", data_states["state"].map(dict(zip(states["state"],
+                                                                     states["STATE"].astype(str).str.zfill(2)))))
+    return (data_states.to_csv(index=False).encode(), data_counties.to_csv(index=False).encode())
+
+
+def _alpha3(i):
+    """Return a 3 letter code for the integer i."""
+    return "".join(chr(ord("A") + (i // 26**k) % 26) for k in (2, 1, 0))
+
+
+def Make_Country_Codes(n_countries=200):
+    """Return a table of synthetic countries, like the slim-3.json file, with the name, alpha-3 and
+    country-code. The two Congos are added, because the JHU loader fixes them up by name."""
+    names = ["Country {:03d}".format(i) for i in range(n_countries)] + ["Congo", "Congo, Democratic Republic of"]
+    return pd.DataFrame({"name": names,
+                         "alpha-3": [_alpha3(i) for i in range(len(names))],
+                         "country-code": np.arange(len(names)) + 1})
+
+
+def Make_Country_Codes_Fixture(country_codes):
+    """Return the contents of the country codes json file."""
+    return country_codes.to_json(orient="records").encode()
+
+
+def Make_JHU_Fixture(rng, country_codes, days, provinces_every=10, provinces=5):
+    """Return the contents of the three JHU time series files, confirmed, deaths and recovered, for days days.
+    Every provinces_every'th country is split into provinces rows, so the Sum_data() groupby has work to do."""
+    names = list(country_codes["name"].iloc[:-2]) + ["Congo (Brazzaville)", "Congo (Kinshasa)"]
+    country, province = [], []
+    for i, name in enumerate(names):
+        if i % provinces_every == 0 and not name.startswith("Congo"):
+            country += [name]*provinces
+            province += ["Province {}".format(p) for p in range(provinces)]
+        else:
+            country.append(name)
+            province.append("")
+    n = len(country)
+    dates = ["{}/{}/{}".format(d.month, d.day, d.year % 100) for d in Make_Dates(days)]
+    head = pd.DataFrame({"Province/State": province, "Country/Region": country,
+                         "Lat": rng.uniform(-60, 70, size=n).round(4), "Long": rng.uniform(-180, 180, size=n).round(4)})
+
+    cases, deaths = _cumulative_counts(rng, days, n, 50.0)
+    recovered = (cases*0.8).astype(np.int64)
+    files = []
+    for counts in (cases, deaths, recovered):
+        table = pd.concat([head, pd.DataFrame(counts.T, columns=dates)], axis=1)
+        files.append(table.to_csv(index=False).encode())
+    return files
+
+
+def Make_World_Pop(country_codes, rng, years=range(1960, 2020)):
+    """Return a table like the worldbank.org population file, after it was read with skiprows=3."""
+    world_pop = pd.DataFrame({"Country Name": country_codes["name"], "Country Code": country_codes["alpha-3"],
+                              "Indicator Name": "Population, total", "Indicator Code": "SP.POP.TOTL"})
+    pop = rng.integers(10000, 100000000, size=len(world_pop))
+    for year in years:
+        world_pop[str(year)] = pop*(1 + (year - 1960)*0.01)
+    return world_pop
+
+
+def Make_World_Pop_Fixture(world_pop):
+    """Return the contents of the worldbank.org Excel file, or None if no Excel writer is installed."""
+    output = tempfile.SpooledTemporaryFile()
+    try:
+        # The real file has 3 lines of title above the header.
+        world_pop.to_excel(output, index=False, startrow=3)
+    except ImportError:
+        return None
+    output.seek(0)
+    return output.read()
+
+
+# The file name of each source in the fixture directory. The NYT files keep their own name,
+# because Sync_NYT_Data adds that to NYT_base_url.
+Fixture_Files = {
+    "state_name_to_abbrev": "name-abbr.json",
+    "abbrev_to_state_name": "abbr-name.json",
+    "census": "co-est2019-alldata.csv",
+    "country_codes": "slim-3.json",
+    "world_pop": "world_pop.xlsx",
+    "jhu_confirmed": "time_series_covid19_confirmed_global.csv",
+    "jhu_deaths": "time_series_covid19_deaths_global.csv",
+    "jhu_recovered": "time_series_covid19_recovered_global.csv",
+}
+
+
+def Write_Fixtures(directory, days=300, n_counties=3000, n_countries=200, n_states=50, seed=1):
+    """Write all the synthetic source files to directory. Return a dictionary with the sources that were
+    written, and the sizes, which is used to find the rows and bytes of the benchmarks."""
+    rng = np.random.default_rng(seed)
+    states = Make_States(n_states)
+    counties = Make_Counties(states, n_counties)
+    country_codes = Make_Country_Codes(n_countries)
+    world_pop = Make_World_Pop(country_codes, rng)
+
+    contents = {}
+    contents["state_name_to_abbrev"], contents["abbrev_to_state_name"] = Make_Abbrevs_Fixture(states)
+    contents["census"] = Make_Census_Fixture(rng, states, counties)
+    contents["country_codes"] = Make_Country_Codes_Fixture(country_codes)
+    contents["jhu_confirmed"], contents["jhu_deaths"], contents["jhu_recovered"] = \
+        Make_JHU_Fixture(rng, country_codes, days)
+    contents["world_pop"] = Make_World_Pop_Fixture(world_pop)
+    nyt = dict(zip(["states", "counties"], Make_NYT_Fixture(rng, states, counties, days)))
+
+    sizes = {}
+    for source, data in contents.items():
+        if data is None:
+            continue
+        with open(os.path.join(directory, Fixture_Files[source]), "wb") as output:
+            output.write(data)
+        sizes[source] = len(data)
+    for which, data in nyt.items():
+        with open(os.path.join(directory, covid.NYT_sources[which][0]), "wb") as output:
+            output.write(data)
+        sizes["nyt_" + which] = len(data)
+    return {"sizes": sizes, "world_pop": world_pop, "days": days, "counties": n_counties,
+            "countries": n_countries, "states": n_states}
+
+
+def Append_NYT_Day(directory, seed=2):
+    """Add one more day to the NYT fixture files in directory, as happens every day with the real files.
+    The counts of the last day are increased a little. Returns the number of bytes added to the files."""
+    rng = np.random.default_rng(seed)
+    appended = 0
+    for which, (file_name, key_columns) in covid.NYT_sources.items():
+        file_name = os.path.join(directory, file_name)
+        data = pd.read_csv(file_name, dtype={"fips": str}, na_filter=False)
+        last = data.loc[data["date"] == data["date"].iloc[-1]].copy()
+        last["date"] = (pd.to_datetime(last["date"]) + pd.Timedelta(days=1)).dt.strftime("%Y-%m-%d")
+        last["cases"] += rng.poisson(5, size=len(last))
+        size = os.path.getsize(file_name)
+        with open(file_name, "a") as output:
+            last.to_csv(output, index=False, header=False)
+        appended += os.path.getsize(file_name) - size
+        # Make sure the modification time moves, even within the same second.
+        mtime = os.stat(file_name).st_mtime + 2
+        os.utime(file_name, (mtime, mtime))
+    return appended
+
+
+#
+# The local stand-in for the web servers.
+#
+class _QuietHandler(SimpleHTTPRequestHandler):
+    """Serve the fixture files without logging every request to the terminal.
+    Like the GitHub server of the NYT files, it sends an ETag, answers "304 Not Modified" to a matching
+    If-None-Match, and sends only the asked for bytes (206) for a "Range: bytes=start-[end]" header.
+    Together that is what the delta sync of Sync_NYT_Data() uses."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().do_GET()
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = '"{:x}-{:x}"'.format(size, stat.st_mtime_ns)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        start, end = 0, size - 1
+        status = 200
+        byte_range = self.headers.get("Range")
+        if byte_range is not None and byte_range.startswith("bytes="):
+            first, last = byte_range[len("bytes="):].split(",")[0].split("-")
+            start = int(first) if first else max(size - int(last), 0)
+            end = min(int(last), size - 1) if first and last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        with open(path, "rb") as infile:
+            infile.seek(start)
+            body = infile.read(end - start + 1)
+        self.send_response(status)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, start + len(body) - 1, size))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@contextlib.contextmanager
+def Fixture_Server(directory):
+    """Serve the files in directory from a local HTTP server, and point the Source_URLs and NYT_base_url at it
+    while in the with block. Yields the base url of the server."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = "http://127.0.0.1:{}/".format(server.server_address[1])
+
+    saved_urls = dict(covid.Source_URLs)
+    saved_base = covid.NYT_base_url
+    covid.Source_URLs.update({source: base_url + file_name for source, file_name in Fixture_Files.items()})
+    covid.NYT_base_url = base_url
+    try:
+        yield base_url
+    finally:
+        covid.Source_URLs.clear()
+        covid.Source_URLs.update(saved_urls)
+        covid.NYT_base_url = saved_base
+        server.shutdown()
+        server.server_close()
+
+
+#
+# A check that a frame of each column type comes back from the cache with the same values and dtypes.
+#
+def Make_Dtype_Frame(n=5):
+    """Return a frame with a column of each dtype the loaders produce, with missing values where the
+    dtype has them."""
+    return pd.DataFrame({
+        "int64": np.arange(n, dtype=np.int64), "int8": np.arange(n, dtype=np.int8),
+        "float64": np.linspace(0, 1, n), "bool": np.arange(n) % 2 == 0,
+        "datetime": pd.date_range("2020-01-22", periods=n),
+        "datetime_tz": pd.date_range("2020-01-22", periods=n, tz="US/Eastern"),
+        "str": pd.Series(["a", None, "b"] + ["a"]*(n - 3), dtype="str"),
+        "string": pd.Series(["a", None, "b"] + ["a"]*(n - 3), dtype="string"),
+        "object": pd.Series(["a", None, "b"] + ["a"]*(n - 3), dtype=object),
+        "category": pd.Categorical(["b", "a", "b"] + ["a"]*(n - 3), categories=["b", "a"], ordered=True),
+        "Int32": pd.array([1, None] + list(range(n - 2)), dtype="Int32"),
+        "Float64": pd.array([0.5, None] + [1.0]*(n - 2), dtype="Float64"),
+        "boolean": pd.array([True, None] + [False]*(n - 2), dtype="boolean"),
+    })
+
+
+def Check_Frame_Roundtrip(directory, fmt="npz"):
+    """Write Make_Dtype_Frame() in the format, read it back and raise RuntimeError for the columns
+    that changed value or dtype."""
+    data = Make_Dtype_Frame()
+    data.this_date = pd.Timestamp("2020-01-26")
+    info = covid.Write_Frame(data, os.path.join(directory, "roundtrip"), fmt)
+    read = covid.Read_Frame(info, directory)
+    changed = [c for c in data.columns if c not in read.columns or read[c].dtype != data[c].dtype or
+               not read[c].equals(data[c])]
+    if changed or read.this_date != data.this_date:
+        raise RuntimeError("The {} format does not keep the columns {} (this_date {}).".format(
+            info["format"], changed, read.this_date))
+
+
+#
+# The benchmarks.
+#
+def _rows(result):
+    """Return the number of rows in a loader result, which is a frame or a tuple of frames."""
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    if isinstance(result, (tuple, list)):
+        return sum(_rows(r) for r in result)
+    if isinstance(result, dict):
+        return len(result)
+    return 0
+
+
+def Run_Benchmark(name, mode, func, setup=None, repeat=3):
+    """Run func() repeat times, calling setup() before each run, and return a dictionary with the median wall
+    time, the rows of the result, the downloaded bytes and the peak memory of the runs.
+    The times come from the profiler "total" record of the outermost call."""
+    walls, peaks, downloads = [], [], []
+    rows = 0
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        covid.Reset_Profiling()
+        start = time.perf_counter()
+        result = func()
+        walls.append(time.perf_counter() - start)
+        rows = _rows(result)
+        report = covid.Profile_Report()
+        # The totals of loaders run on pool threads have no peak, the outermost call includes them.
+        totals = [r["peak_mb"] for r in report if r["stage"] == "total" and r["peak_mb"] is not None]
+        if totals:
+            peaks.append(max(totals))
+        downloads.append(sum(r["bytes"] for r in report if r["stage"] == "download"))
+
+    wall = statistics.median(walls)
+    nbytes = max(downloads)
+    return {"benchmark": name, "mode": mode, "repeat": repeat, "wall_s": wall, "min_wall_s": min(walls),
+            "rows": rows, "rows_per_s": rows/wall if wall > 0 else None,
+            "download_mb": nbytes/1024**2, "mb_per_s": nbytes/1024**2/wall if wall > 0 else None,
+            "peak_mb": max(peaks) if peaks else None}
+
+
+def Run_Suite(days=300, n_counties=3000, n_countries=200, repeat=3, memory=True, fmt=None, seed=1,
+              work_dir=None):
+    """Generate the fixtures, serve them locally, and benchmark each loader, cold (empty cache) and warm
+    (everything cached). Return the fixture parameters and a list with the result of each benchmark."""
+    own_dir = work_dir is None
+    if own_dir:
+        work_dir = tempfile.mkdtemp(prefix="covid19_bench_")
+    fixture_dir = os.path.join(work_dir, "fixtures")
+    os.makedirs(fixture_dir, exist_ok=True)
+    saved_cache = covid.cache
+    results = []
+    try:
+        fixtures = Write_Fixtures(fixture_dir, days, n_counties, n_countries, seed=seed)
+        Check_Frame_Roundtrip(work_dir, "npz")
+        counter = iter(range(1000000))
+
+        def fresh_cache():
+            covid.Set_Cache(os.path.join(work_dir, "cache_{}".format(next(counter))), fmt=fmt)
+
+        covid.Enable_Profiling(memory=memory)
+        with Fixture_Server(fixture_dir):
+            benchmarks = [
+                ("Get_Census_Data", covid.Get_Census_Data),
+                ("Get_Country_Codes", partial(covid.Get_Country_Codes, from_web=None)),
+                ("Get_Global_data", partial(covid.Get_Global_data, from_web=None)),
+                ("Get_Global_data(compact)", partial(covid.Get_Global_data, from_web=None, compact=True)),
+                ("Get_NYT_USA_Data", covid.Get_NYT_USA_Data),
+                ("Get_NYT_USA_Data(compact)", partial(covid.Get_NYT_USA_Data, compact=True)),
+            ]
+            if "world_pop" in fixtures["sizes"]:
+                benchmarks.append(("Get_World_Pop_Data", partial(covid.Get_World_Pop_Data, from_web=None)))
+
+            for name, func in benchmarks:
+                results.append(Run_Benchmark(name, "cold", func, setup=fresh_cache, repeat=repeat))
+                results.append(Run_Benchmark(name, "warm", func, repeat=repeat))
+
+            # One new day in the NYT files, as on every day the NYT data is updated. The store was just
+            # synced, so the TTL is set to 0 to make the sync ask the server for the new day.
+            appended = []
+
+            def new_day():
+                appended.append(Append_NYT_Day(fixture_dir, seed=next(counter)))
+            saved_ttl = covid.Cache_TTL["nyt"]
+            covid.Cache_TTL["nyt"] = 0
+            try:
+                results.append(Run_Benchmark("Get_NYT_USA_Data", "new_day", covid.Get_NYT_USA_Data, setup=new_day,
+                                             repeat=repeat))
+            finally:
+                covid.Cache_TTL["nyt"] = saved_ttl
+            # The sync should only download the new rows, plus the stored tail of each file it checks.
+            limit = max(appended) + 256*len(covid.NYT_sources)
+            if results[-1]["download_mb"] == 0:
+                raise RuntimeError("The new_day sync did not download the new day.")
+            if results[-1]["download_mb"]*1024**2 > limit:
+                raise RuntimeError("The new_day sync downloaded {:.0f} bytes, but only {} bytes were added: the "
+                                   "delta sync was not used.".format(results[-1]["download_mb"]*1024**2,
+                                                                     max(appended)))
+
+            # The in-memory steps, on the loaded (warm) data.
+            country_codes = covid.Get_Country_Codes()
+            data = covid.Get_Global_data(country_codes)
+            if "world_pop" in fixtures["sizes"]:
+                world_pop = covid.Get_World_Pop_Data()
+            else:
+                world_pop = fixtures["world_pop"].rename(columns={"Country Code": "code", "Country Name": "Country"})
+            results.append(Run_Benchmark("Sum_data", "memory", partial(covid.Sum_data, *data, country_codes),
+                                         repeat=repeat))
+            sums = covid.Sum_data(*data, country_codes)
+            results.append(Run_Benchmark("Add_Population_Data", "memory",
+                                         partial(covid.Add_Population_Data, sums[0], world_pop), repeat=repeat))
+    finally:
+        covid.Disable_Profiling()
+        covid.Reset_Profiling()
+        covid.cache = saved_cache
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    parameters = {k: fixtures[k] for k in ("days", "counties", "countries", "states")}
+    parameters.update({"repeat": repeat, "memory": memory, "format": fmt or covid.Frame_Formats[0],
+                       "fixture_bytes": fixtures["sizes"], "seed": seed})
+    return parameters, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the COVID19 data loaders, "
+                                                 "on synthetic data served from a local web server.")
+    parser.add_argument("--days", type=int, default=300, help="Number of days in the time series.")
+    parser.add_argument("--counties", type=int, default=3000, help="Number of US counties.")
+    parser.add_argument("--countries", type=int, default=200, help="Number of countries in the JHU data.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each benchmark.")
+    parser.add_argument("--format", default=None, choices=covid.Frame_Formats,
+                        help="Storage format of the cache.")
+    parser.add_argument("--no-memory", action="store_true", help="Do not trace the peak memory, which is faster.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic data.")
+    parser.add_argument("--json", default=None, help="Also write the results to this json file.")
+    args = parser.parse_args(argv)
+
+    parameters, results = Run_Suite(args.days, args.counties, args.countries, args.repeat,
+                                    memory=not args.no_memory, fmt=args.format, seed=args.seed)
+    table = pd.DataFrame(results).set_index(["benchmark", "mode"])
+    print("days={days} counties={counties} countries={countries} repeat={repeat} format={format}".format(
+        **parameters))
+    with pd.option_context("display.width", 200, "display.max_columns", 20, "display.float_format", "{:.4g}".format):
+        print(table.drop(columns=["repeat"]))
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"parameters": parameters, "results": results, "host": platform.node(),
+                       "time": time.time()}, output, indent=1)
+
+
+if __name__ == "__main__":
+    main()
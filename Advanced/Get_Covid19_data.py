@@ -8,66 +8,796 @@
 # The code is implemented to use Pandas, and to simply use some methods
 # that return the datasets for use in a Python notebook.
 #
-import numpy as np
+# All downloads are cached on disk by the DataCache below. The Get_* functions take
+# a from_web argument: None (default) uses the cached copy if it is younger than the
+# TTL for that source, True always downloads a fresh copy, and False uses any cached
+# copy, no matter how old, and only downloads when there is nothing in the cache.
+# The cache directory is "covid19_cache", or the COVID19_CACHE_DIR environment variable,
+# or can be set with Set_Cache().
+#
+# numpy, pandas, requests and pyarrow are only imported when they are first used, so the import of
+# this module is fast. To refresh all the sources in the cache, e.g. from cron, run:
+#    python Get_Covid19_data.py sync
+#
 import os
-import pandas as pd
-import requests
+import platform
+import sys
 import json
+import importlib
+import importlib.util
+import io
+import time
+import datetime
+import hashlib
+import pickle
+import tempfile
+import threading
+import zipfile
+import struct
+import functools
+import contextlib
+import contextvars
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class _LazyModule(object):
+    """Stand-in for a module, which is imported when one of its attributes is first used. The module then
+    replaces the stand-in under the name alias in this module, so later uses cost nothing extra.
+    The submodules are imported at the same time, e.g. "pyarrow.feather" for pyarrow."""
+
+    def __init__(self, name, alias, *submodules):
+        self._name = name
+        self._alias = alias
+        self._submodules = submodules
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        module = importlib.import_module(self._name)
+        for submodule in self._submodules:
+            importlib.import_module(submodule)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+np = _LazyModule("numpy", "np")
+pd = _LazyModule("pandas", "pd")
+requests = _LazyModule("requests", "requests")
 # try:
 #     import plotly.express as px
 #     import plotly.graph_objects as go
 # except:
 #     print("No plotly available. No plotting done in this script.")
 
-def Get_Abbrevs():
+Source_URLs = {
+    "state_name_to_abbrev": "https://worldpopulationreview.com/static/states/name-abbr.json",
+    "abbrev_to_state_name": "https://worldpopulationreview.com/static/states/abbr-name.json",
+    "county_geo": "https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json",
+    "census": "https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/counties/totals/co-est2019-alldata.csv",
+    "country_codes": "https://raw.githubusercontent.com/lukes/ISO-3166-Countries-with-Regional-Codes/master/slim-3/slim-3.json",
+    "world_pop": "http://api.worldbank.org/v2/en/indicator/SP.POP.TOTL?downloadformat=excel",
+    "jhu_confirmed": "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv",
+    "jhu_deaths": "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv",
+    "jhu_recovered": "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv",
+}
+
+# How long a cached copy is considered fresh, in seconds.
+Cache_TTL = {
+    "abbrevs": 30*24*3600,
+    "county_geo": 365*24*3600,
+    "census": 365*24*3600,
+    "country_codes": 30*24*3600,
+    "world_pop": 30*24*3600,
+    "jhu_global": 6*3600,
+    "nyt": 6*3600,
+    "county_geometry": 365*24*3600,
+}
+
+# Version of the processing done on each source. Increase it when the processing changes,
+# so that the old cache entries are no longer used.
+Cache_Versions = {
+    "abbrevs": 1,
+    "county_geo": 1,
+    "census": 3,
+    "census_data": 2,
+    "country_codes": 3,
+    "world_pop": 2,
+    "jhu_global": 2,
+    "nyt": 2,                  # Version 2 stores the date as datetime64.
+    "metrics": 2,
+    "county_geometry": 1,
+}
+
+#
+# Rows that are added "by hand" to the downloaded tables, because they are missing from the source.
+# The additions for each table are made with a single concatenation by Apply_Supplements().
+#
+Supplemental_Rows = {
+    # Census data for Porto Rico (72), Guam (66), Northern Mariana Islands (69), Virgin Islands (78).
+    "census": [
+        {"SUMLEV": 40, "REGION": 5, "DIVISION": 1, "STATE": 72, "COUNTY": 0, "fips": '72000',
+         "STNAME": "Puerto Rico", "CTYNAME": "Puerto Rico", "CENSUS2010POP": 3726157, "POPESTIMATE2019": 3193694},
+        {"SUMLEV": 40, "REGION": 5, "DIVISION": 2, "STATE": 66, "COUNTY": 0, "fips": '66000',
+         "STNAME": "Guam", "CTYNAME": "Guam", "CENSUS2010POP": 159358, "POPESTIMATE2019": 167294},
+        {"SUMLEV": 40, "REGION": 5, "DIVISION": 2, "STATE": 69, "COUNTY": 0, "fips": '69000',
+         "STNAME": "Northern Mariana Islands", "CTYNAME": "Northern Mariana Islands",
+         "CENSUS2010POP": 53971, "POPESTIMATE2019": 57216},
+        {"SUMLEV": 40, "REGION": 5, "DIVISION": 2, "STATE": 78, "COUNTY": 0, "fips": '78000',
+         "STNAME": "Virgin Islands", "CTYNAME": "Virgin Islands", "CENSUS2010POP": 106087, "POPESTIMATE2019": 104578},
+    ],
+    # Pseudo countries that show up in the JHU data.
+    "country_codes": [
+        {'name': 'Other', 'alpha-3': 'XXX', "country-code": 999},
+        {'name': 'Diamond Princess', 'alpha-3': 'XX1', "country-code": 991},
+        {'name': 'Kosovo', 'alpha-3': 'XX2', "country-code": 992},
+        {'name': 'MS Zaandam', 'alpha-3': 'XX3', "country-code": 993},
+    ],
+    "world_pop": [
+        {"Country": "Taiwan", "code": "TWN", "Indicator Name": "Population, total", "2018": 23816775},
+        {"Country": "Holy See", "code": "VAT", "Indicator Name": "Population total", "2018": 801},
+        {"Country": "Western Sahara", "code": "ESH", "Indicator Name": "Population total", "2018": 597339},
+    ],
+}
+
+# Names used by JHU that differ from the ISO-3166 names: (ISO name, JHU name)
+country_name_aliases = [
+    ('Bolivia (Plurinational State of)', 'Bolivia'),
+    ('Brunei Darussalam', 'Brunei'),
+    ("Côte d'Ivoire", "Cote d'Ivoire"),
+    ("Iran (Islamic Republic of)", 'Iran'),
+    ("Korea, Republic of", 'Korea, South'),
+    ("Moldova, Republic of", 'Moldova'),
+    ("Russian Federation", "Russia"),
+    ("Taiwan, Province of China", "Taiwan*"),
+    ("Tanzania, United Republic of", "Tanzania"),
+    ("United Kingdom of Great Britain and Northern Ireland", "United Kingdom"),
+    ("United States of America", "US"),
+    ("Venezuela (Bolivarian Republic of)", "Venezuela"),
+    ("Viet Nam", "Vietnam"),
+    ("Syrian Arab Republic", "Syria"),
+    ("Lao People's Democratic Republic", "Laos"),
+    ("Palestine, State of", "West Bank and Gaza"),
+    ("Myanmar", "Burma"),
+]
+
+
+def Apply_Supplements(data, dataset):
+    """Return data with the Supplemental_Rows for dataset added, in a single concatenation.
+    For the "country_codes" the country_name_aliases are added too, as copies of the row of the ISO name
+    with the JHU name, if that name is not already there."""
+    patches = [pd.DataFrame(Supplemental_Rows[dataset])]
+    if dataset == "country_codes":
+        aliases = pd.DataFrame(country_name_aliases, columns=["old", "name"])
+        aliases = aliases.loc[~aliases["name"].isin(data["name"])]
+        add = data.merge(aliases, left_on="name", right_on="old", suffixes=("_old", ""))
+        patches.insert(0, add[data.columns])
+    return pd.concat([data] + patches, ignore_index=True)
+
+
+#
+# Opt-in profiling of the loaders. After Enable_Profiling(), each stage of each Get_* function records
+# the wall time, the bytes downloaded, the rows processed and (with memory=True) the peak memory that
+# was allocated by Python during the stage. Profile_Report() returns the records, Profile_JSON() the same
+# as JSON, and Profile_Summary() a table with the totals per function and stage.
+# The tracemalloc peak is shared by all threads, so only one thread at a time measures it: the first
+# one to enter a stage, until it leaves that stage. Its stages include the memory that threads it waits
+# for allocate, e.g. the downloads of Fetch_All(). The stages of the other threads get a peak_mb of None.
+#
+class Profiler(object):
+    """Collects the records of the profiled stages."""
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._memory_owner = None
+        self._memory_depth = 0
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _measure_memory(self, depth):
+        """Return True if the current thread measures the memory of a stage that starts at depth."""
+        thread = threading.get_ident()
+        with self._lock:
+            if self._memory_owner is None:
+                self._memory_owner, self._memory_depth = thread, depth
+            return self._memory_owner == thread
+
+    @contextlib.contextmanager
+    def stage(self, stage, function=None, rows=None):
+        """Context manager that records one stage. It yields the record, so that the rows and bytes can be
+        filled in inside the with block."""
+        if not self.enabled:
+            yield {}
+            return
+        record = {"function": function if function is not None else _profile_function.get(), "stage": stage,
+                  "start": time.time(), "wall_s": 0., "bytes": 0, "rows": rows, "peak_mb": None,
+                  "thread": threading.current_thread().name}
+        stack = self._stack()
+        measure = self.memory and self._measure_memory(len(stack))
+        if measure:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if stack and "_peak" in stack[-1]:
+                stack[-1]["_peak"] = max(stack[-1]["_peak"], peak)
+            record["_start"], record["_peak"] = current, current
+            tracemalloc.reset_peak()
+        stack.append(record)
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - t0
+            stack.pop()
+            if measure:
+                # The peak is reset by each stage, so pass the peak of this stage on to the enclosing one.
+                peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+                record["peak_mb"] = (peak - record.pop("_start"))/1024**2
+                if stack and "_peak" in stack[-1]:
+                    stack[-1]["_peak"] = max(stack[-1]["_peak"], peak)
+                tracemalloc.reset_peak()
+                with self._lock:
+                    if len(stack) == self._memory_depth:
+                        self._memory_owner = None
+            with self._lock:
+                self.records.append(record)
+
+
+profiler = Profiler()
+_profile_function = contextvars.ContextVar("profile_function", default=None)
+
+
+def Profile_Stage(stage, rows=None):
+    """Return a context manager that records a stage of the current function, see Profiler.stage()."""
+    return profiler.stage(stage, rows=rows)
+
+
+def profiled(func):
+    """Decorator that records the whole call of func as the stage "total", and makes func the
+    function name for the stages recorded inside it."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not profiler.enabled:
+            return func(*args, **kwargs)
+        token = _profile_function.set(func.__name__)
+        try:
+            with profiler.stage("total"):
+                return func(*args, **kwargs)
+        finally:
+            _profile_function.reset(token)
+    return wrapper
+
+
+def Enable_Profiling(memory=False):
+    """Start recording the stages of the loaders. With memory=True the peak memory is recorded too,
+    using tracemalloc, which makes everything slower."""
+    profiler.enabled = True
+    profiler.memory = memory
+
+
+def Disable_Profiling():
+    """Stop recording the stages. The records are kept until Reset_Profiling()."""
+    profiler.enabled = False
+    if profiler.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def Reset_Profiling():
+    """Remove all the records."""
+    with profiler._lock:
+        profiler.records = []
+
+
+def Profile_Report():
+    """Return a list with a dictionary for each recorded stage."""
+    with profiler._lock:
+        return [dict(r) for r in profiler.records]
+
+
+def Profile_JSON():
+    """Return the recorded stages as a JSON string, e.g. to send to a metrics system."""
+    return json.dumps({"host": platform.node(), "pid": os.getpid(), "stages": Profile_Report()})
+
+
+def Profile_Summary():
+    """Return a table with the number of calls, the total wall time, bytes and rows, and the largest peak memory,
+    for each function and stage."""
+    report = pd.DataFrame(Profile_Report(), columns=["function", "stage", "wall_s", "bytes", "rows", "peak_mb"])
+    # Stages run outside of a profiled function, e.g. a direct DataCache.fetch(), are listed under "-".
+    report["function"] = report["function"].fillna("-")
+    return report.groupby(["function", "stage"]).agg(
+        calls=("wall_s", "size"), wall_s=("wall_s", "sum"), bytes=("bytes", "sum"), rows=("rows", "sum"),
+        peak_mb=("peak_mb", "max"))
+
+
+def _atomic_write(file_name, write):
+    """Call write(file) on a temporary file in the same directory, then rename it to file_name.
+    The rename is atomic, so other processes see either the old or the new file, never half a file."""
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_name)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as output:
+            write(output)
+        os.replace(tmp_name, file_name)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+#
+# Binary, column based storage of the DataFrames. The "feather" (Arrow) and "parquet" formats need pyarrow.
+# The "npz" format only needs numpy: each column is stored uncompressed in a zip file, so the numeric, datetime
+# and category (codes) columns are memory mapped straight from the file, and all notebook kernels on a host
+# share the same pages. String columns are stored as codes into a table of the unique strings; on a load they
+# become an object array that points to those strings, so they cost 8 bytes per row, but are not shared.
+# Nullable (Int32, boolean, ...) columns are stored as the values and a mask of the missing ones.
+# Columns that fit none of these (e.g. a mix of Python objects) make the frame go to the "pickle" format.
+# The column names, dtypes and the this_date of the frame are stored in a small dictionary, next to the data.
+#
+if importlib.util.find_spec("pyarrow") is not None:
+    pyarrow = _LazyModule("pyarrow", "pyarrow", "pyarrow.feather", "pyarrow.parquet")
+    Frame_Formats = ("feather", "parquet", "npz", "pickle")
+else:
+    pyarrow = None
+    Frame_Formats = ("npz", "pickle")
+
+# Use the fast orjson parser for the (large) GeoJSON files when it is available.
+if importlib.util.find_spec("orjson") is not None:
+    orjson = _LazyModule("orjson", "orjson")
+else:
+    orjson = None
+
+
+def _json_loads(text):
+    """Parse the JSON text with orjson, or with json if orjson is not installed."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+Frame_Extensions = {"feather": ".feather", "parquet": ".parquet", "npz": ".npz", "pickle": ".pkl"}
+
+
+def Write_Frame(data, file_base, fmt=None):
+    """Write the DataFrame data to file_base plus the extension for the format fmt (default is the first
+    of Frame_Formats). Return a dictionary with the information that Read_Frame needs to read it back."""
+    if fmt is None:
+        fmt = Frame_Formats[0]
+    if fmt not in Frame_Formats:
+        raise ValueError("Format {} is not available, use one of {}".format(fmt, Frame_Formats))
+    if not isinstance(data.index, pd.RangeIndex) or data.index.start != 0 or data.index.step != 1:
+        fmt = "pickle"   # Only the plain 0..n-1 index is stored by the column formats.
+    elif fmt in ("feather", "parquet") and not all(isinstance(c, str) for c in data.columns):
+        fmt = "npz"      # Arrow needs string column names.
+    if fmt == "npz" and (data.columns.has_duplicates or
+                         not all(_npz_storable(data.iloc[:, i]) for i in range(len(data.columns)))):
+        fmt = "pickle"
+
+    info = {"file": os.path.basename(file_base) + Frame_Extensions[fmt], "format": fmt}
+    info.update(_encode_this_date(data.__dict__.get("this_date")))
+    file_name = file_base + Frame_Extensions[fmt]
+    if fmt == "feather":
+        table = pyarrow.Table.from_pandas(data, preserve_index=False)
+        _atomic_write(file_name, lambda output: pyarrow.feather.write_feather(table, output,
+                                                                              compression="uncompressed"))
+    elif fmt == "parquet":
+        table = pyarrow.Table.from_pandas(data, preserve_index=False)
+        _atomic_write(file_name, lambda output: pyarrow.parquet.write_table(table, output))
+    elif fmt == "npz":
+        arrays = {}
+        columns = []
+        for i, col in enumerate(data.columns):
+            arrays["c{}".format(i)], kind, options = _column_to_arrays(data[col], i, arrays)
+            columns.append([col, kind, options])
+        info["columns"] = columns
+        _atomic_write(file_name, lambda output: np.savez(output, **arrays))
+    else:
+        _atomic_write(file_name, lambda output: data.to_pickle(output))
+    return info
+
+
+def _encode_this_date(this_date):
+    """Return a dictionary with the this_date of a frame as a string, and its type, which can be stored as JSON."""
+    if this_date is None:
+        return {}
+    if isinstance(this_date, pd.Timestamp):
+        return {"this_date": this_date.isoformat(), "this_date_type": "timestamp"}
+    if isinstance(this_date, np.datetime64):
+        return {"this_date": str(this_date), "this_date_type": "datetime64"}
+    if isinstance(this_date, datetime.datetime):
+        return {"this_date": this_date.isoformat(), "this_date_type": "datetime"}
+    return {"this_date": str(this_date), "this_date_type": "str"}
+
+
+def _decode_this_date(info):
+    """Return the this_date stored by _encode_this_date in info, or None."""
+    this_date = info.get("this_date")
+    kind = info.get("this_date_type", "str")
+    if this_date is None:
+        return None
+    if kind == "timestamp":
+        return pd.Timestamp(this_date)
+    if kind == "datetime64":
+        return np.datetime64(this_date)
+    if kind == "datetime":
+        return datetime.datetime.fromisoformat(this_date)
+    return this_date
+
+
+def _is_masked(dtype):
+    """Return True for the nullable numeric and boolean dtypes (Int32, Float64, boolean, ...), that are values
+    with a mask of the missing ones."""
+    return isinstance(dtype, pd.api.extensions.ExtensionDtype) and dtype.kind in "biuf" and \
+        hasattr(dtype, "numpy_dtype")
+
+
+def _npz_storable(column):
+    """Return True if _column_to_arrays can store the column."""
+    dtype = column.dtype
+    if isinstance(dtype, (pd.CategoricalDtype, pd.DatetimeTZDtype, pd.StringDtype)) or _is_masked(dtype):
+        return True
+    if isinstance(dtype, np.dtype):
+        return dtype.kind in "biufcmM" or (dtype == object and
+                                           pd.api.types.infer_dtype(column, skipna=True) in ("string", "empty"))
+    return False
+
+
+def _column_to_arrays(column, i, arrays):
+    """Return a numpy array, that can be memory mapped, for the column, a string for the kind of column, and a
+    dictionary with what is needed to restore the dtype. Extra arrays for categories, strings and missing
+    values are added to arrays."""
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = dtype.categories
+        if isinstance(categories.dtype, np.dtype) and categories.dtype.kind in "biufmM":
+            arrays["k{}".format(i)] = categories.to_numpy()
+        else:
+            arrays["k{}".format(i)] = np.asarray(categories.astype(str), dtype=str)
+        return column.cat.codes.to_numpy(), "category", {"ordered": bool(dtype.ordered)}
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return column.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy(), "datetimetz", {"tz": str(dtype.tz)}
+    if _is_masked(dtype):
+        missing = column.isna().to_numpy()
+        if missing.any():
+            arrays["m{}".format(i)] = missing
+        return column.to_numpy(dtype=dtype.numpy_dtype, na_value=0), "masked", {"dtype": str(dtype)}
+    if isinstance(dtype, np.dtype) and dtype.kind in "biufcmM":
+        return column.to_numpy(), "numpy", {}
+    # Strings are stored as an index into a table of the unique values, which is much faster to turn back
+    # into Python strings than one string per row. Missing values get a mask.
+    missing = column.isna().to_numpy()
+    if missing.any():
+        arrays["m{}".format(i)] = missing
+    uniques, codes = np.unique(np.asarray(column.astype(object).where(~missing, "").astype(str), dtype=str),
+                               return_inverse=True)
+    arrays["k{}".format(i)] = uniques
+    return codes.astype(np.int32), "string", {"dtype": str(dtype)}
+
+
+def _npz_memmap(file_name):
+    """Return a dictionary with a memory map of each array in the uncompressed npz file_name."""
+    arrays = {}
+    with zipfile.ZipFile(file_name) as zip_file, open(file_name, "rb") as infile:
+        for info in zip_file.infolist():
+            name = info.filename[:-4]   # Remove the ".npy"
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zip_file.open(info) as member:
+                    arrays[name] = np.load(member)
+                continue
+            # Skip the zip local file header to find the start of the .npy data.
+            infile.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", infile.read(4))
+            infile.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(infile)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(infile)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(infile)
+            if dtype.hasobject:
+                raise ValueError("The array {} in {} holds Python objects, which cannot be memory mapped.".format(
+                    name, file_name))
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                # Copy-on-write: the pages are shared until a row is changed, which then only changes this copy.
+                arrays[name] = np.memmap(file_name, dtype=dtype, mode="c", offset=infile.tell(), shape=shape,
+                                         order="F" if fortran_order else "C")
+    return arrays
+
+
+def Read_Frame(info, directory):
+    """Read the DataFrame described by info, as returned by Write_Frame, from the directory.
+    The feather and npz formats are memory mapped."""
+    file_name = os.path.join(directory, info["file"])
+    fmt = info["format"]
+    if fmt == "feather":
+        data = pyarrow.feather.read_table(file_name, memory_map=True).to_pandas(split_blocks=True)
+    elif fmt == "parquet":
+        data = pyarrow.parquet.read_table(file_name, memory_map=True).to_pandas(split_blocks=True)
+    elif fmt == "npz":
+        arrays = _npz_memmap(file_name)
+        columns = {}
+        for i, (col, kind, *options) in enumerate(info["columns"]):
+            options = options[0] if options else {}
+            values = arrays["c{}".format(i)]
+            missing = arrays.get("m{}".format(i))
+            if kind == "category":
+                columns[col] = pd.Categorical.from_codes(values, categories=arrays["k{}".format(i)],
+                                                         ordered=options.get("ordered", False))
+            elif kind == "string":
+                values = arrays["k{}".format(i)].astype(object)[values]
+                if missing is not None:
+                    values[missing] = None
+                columns[col] = pd.Series(values, dtype=options["dtype"], copy=False) if "dtype" in options else values
+            elif kind == "masked":
+                array_type = pd.api.types.pandas_dtype(options["dtype"]).construct_array_type()
+                columns[col] = array_type(values, missing if missing is not None else np.zeros(len(values), bool))
+            elif kind == "datetimetz":
+                columns[col] = pd.Series(values, copy=False).dt.tz_localize("UTC").dt.tz_convert(options["tz"])
+            else:
+                columns[col] = values
+        data = pd.DataFrame(columns, copy=False)
+        if len(data.columns) == 0:
+            data = pd.DataFrame(index=pd.RangeIndex(0))
+    else:
+        data = pd.read_pickle(file_name)
+    this_date = _decode_this_date(info)
+    if this_date is not None:
+        data.this_date = this_date
+    return data
+
+
+class DataCache(object):
+    """On disk cache for the downloaded and processed data.
+    Each entry is keyed by the source URL(s) and the processing version. DataFrames, or tuples of
+    DataFrames, are stored with Write_Frame in the format fmt, anything else as a pickle. A small JSON
+    file next to it has the url, version, creation time, size and the information to read the frames back.
+    When the total size is larger than max_bytes, the least recently used entries are removed.
+    The NYT stores of Sync_NYT_Data() in the cache directory are entries too, and count for the size."""
+
+    def __init__(self, cache_dir=None, max_bytes=2*1024**3, fmt=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get("COVID19_CACHE_DIR", "covid19_cache")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fmt = fmt if fmt is not None else Frame_Formats[0]
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "writes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _count(self, what):
+        with self._lock:
+            self.stats[what] += 1
+
+    def entry_name(self, name, url, version):
+        """Return the file name, without extension, of the cache entry."""
+        key = hashlib.sha1("{}|{}".format(url, version).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, "{}-{}".format(name, key))
+
+    def load(self, name, url, version, ttl=None):
+        """Return the cached object, or None if there is no entry, or if it is older than ttl seconds."""
+        base = self.entry_name(name, url, version)
+        try:
+            with open(base + ".json") as infile:
+                meta = json.load(infile)
+            if ttl is not None and time.time() - meta["created"] > ttl:
+                self._count("stale")
+                return None
+            if meta["kind"] == "pickle":
+                with open(base + ".pkl", "rb") as infile:
+                    obj = pickle.load(infile)
+            else:
+                obj = [Read_Frame(info, self.cache_dir) for info in meta["frames"]]
+                obj = tuple(obj) if meta["kind"] == "frames" else obj[0]
+            os.utime(base + ".json")   # Mark as recently used.
+        except (OSError, ValueError, KeyError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+            # AttributeError or ImportError: the pickle has a class that is not (or no longer) found.
+            return None
+        return obj
+
+    def store(self, name, url, version, obj):
+        """Store obj in the cache, and remove old entries if the cache is too large."""
+        base = self.entry_name(name, url, version)
+        meta = {"name": name, "url": url, "version": version, "created": time.time()}
+        if isinstance(obj, pd.DataFrame):
+            meta["kind"] = "frame"
+            meta["frames"] = [Write_Frame(obj, base, self.fmt)]
+        elif isinstance(obj, tuple) and len(obj) and all(isinstance(o, pd.DataFrame) for o in obj):
+            meta["kind"] = "frames"
+            meta["frames"] = [Write_Frame(o, "{}.{}".format(base, i), self.fmt) for i, o in enumerate(obj)]
+        else:
+            meta["kind"] = "pickle"
+            meta["frames"] = [{"file": os.path.basename(base) + ".pkl"}]
+            _atomic_write(base + ".pkl", lambda output: pickle.dump(obj, output, protocol=pickle.HIGHEST_PROTOCOL))
+        meta["files"] = [info["file"] for info in meta["frames"]]
+        meta["size"] = sum(os.path.getsize(os.path.join(self.cache_dir, f)) for f in meta["files"])
+        # The JSON file is written last, so an entry is only found when all its data files are complete.
+        try:
+            sidecar = json.dumps(meta).encode()
+        except (TypeError, ValueError):
+            self.remove(base, meta["files"])
+            raise
+        _atomic_write(base + ".json", lambda output: output.write(sidecar))
+        self._count("writes")
+        self.evict(keep=base)
+
+    def fetch(self, name, url, build, version=1, ttl=None, from_web=None):
+        """Return the cached object for (url, version), calling build() to make it when needed.
+        from_web=None respects the ttl, from_web=True always calls build(), and from_web=False
+        uses the cached object no matter how old it is."""
+        obj = None
+        if from_web is not True:
+            with Profile_Stage("cache_load"):
+                obj = self.load(name, url, version, ttl=None if from_web is False else ttl)
+        if obj is not None:
+            self._count("hits")
+            return obj
+        self._count("misses")
+        with Profile_Stage("build"):
+            obj = build()
+        with Profile_Stage("cache_store"):
+            self.store(name, url, version, obj)
+        return obj
+
+    def entries(self):
+        """Return a list of (last_used, size, base_name, files) for all the entries in the cache."""
+        out = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".json"):
+                base = os.path.join(self.cache_dir, file_name[:-5])
+                try:
+                    with open(base + ".json") as infile:
+                        meta = json.load(infile)
+                    out.append((os.path.getmtime(base + ".json"), meta["size"], base, meta["files"]))
+                except (OSError, ValueError, KeyError):
+                    continue
+        return out
+
+    def remove(self, base, files):
+        """Remove the entry base, with its data files."""
+        for file_name in [base + ".json"] + [os.path.join(self.cache_dir, f) for f in files]:
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache is smaller than max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(e[1] for e in entries)
+        for last_used, size, base, files in entries:
+            if total <= self.max_bytes:
+                break
+            if base == keep:
+                continue
+            self.remove(base, files)
+            total -= size
+            self._count("evictions")
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        for last_used, size, base, files in self.entries():
+            self.remove(base, files)
+
+
+cache = None
+
+
+def Get_Cache():
+    """Return the DataCache used by the Get_* functions, creating it with the defaults if needed."""
+    global cache
+    if cache is None:
+        cache = DataCache()
+    return cache
+
+
+def Set_Cache(cache_dir=None, max_bytes=2*1024**3, fmt=None):
+    """Use a new DataCache in cache_dir, with a size limit of max_bytes, storing the tables in
+    format fmt (one of Frame_Formats), for all the Get_* functions."""
+    global cache
+    cache = DataCache(cache_dir, max_bytes, fmt)
+    return cache
+
+
+def Cache_Stats():
+    """Return a copy of the hit/miss counters of the cache, for monitoring."""
+    return dict(Get_Cache().stats)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def Get_Session():
+    """Return the requests Session shared by all downloads. The session keeps the connections
+    alive in a pool, and retries failed requests with an exponential backoff."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            retry = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=("GET", "HEAD"))
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+    return _session
+
+
+def Fetch_URL(url):
+    """Download url with the shared session and return the content as bytes."""
+    with Profile_Stage("download") as record:
+        response = Get_Session().get(url)
+        response.raise_for_status()
+        record["bytes"] = len(response.content)
+    return response.content
+
+
+def Fetch_All(urls, max_workers=8):
+    """Download all the urls in parallel, and return a list with the content of each, in the same order.
+    The total time is about that of the slowest download, instead of the sum of all of them."""
+    if len(urls) <= 1:
+        return [Fetch_URL(url) for url in urls]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as pool:
+        # Run each download in a copy of the context, so the profiler knows which function asked for it.
+        futures = [pool.submit(contextvars.copy_context().run, Fetch_URL, url) for url in urls]
+        return [f.result() for f in futures]
+
+
+@profiled
+def Get_Abbrevs(from_web=None):
     #
     # Handy table to map state name to abbreviation.
     #
-    state_name_to_abbrev_url = "https://worldpopulationreview.com/static/states/name-abbr.json"
-    state_name_to_abbrev = requests.get(state_name_to_abbrev_url).json()
-    abbrev_to_state_name_url = "https://worldpopulationreview.com/static/states/abbr-name.json"
-    abbrev_to_state_name = requests.get(abbrev_to_state_name_url).json()
-
-    # Add some "States" by hand.
-    state_name_to_abbrev["Puerto Rico"]="PR"
-    abbrev_to_state_name["PR"]="Puerto Rico"
-    state_name_to_abbrev["Guam"]="GU"
-    abbrev_to_state_name["GU"]="Guam"
-    state_name_to_abbrev["Virgin Islands"]="VI"
-    abbrev_to_state_name["VI"]="Virgin Islands"
-    state_name_to_abbrev["Northern Mariana Islands"]="MP"
-    abbrev_to_state_name["MP"]="Northern Mariana Islands"
-    
+    def build():
+        name_abbr, abbr_name = Fetch_All([Source_URLs["state_name_to_abbrev"], Source_URLs["abbrev_to_state_name"]])
+        state_name_to_abbrev = json.loads(name_abbr)
+        abbrev_to_state_name = json.loads(abbr_name)
+
+        # Add some "States" by hand.
+        state_name_to_abbrev["Puerto Rico"]="PR"
+        abbrev_to_state_name["PR"]="Puerto Rico"
+        state_name_to_abbrev["Guam"]="GU"
+        abbrev_to_state_name["GU"]="Guam"
+        state_name_to_abbrev["Virgin Islands"]="VI"
+        abbrev_to_state_name["VI"]="Virgin Islands"
+        state_name_to_abbrev["Northern Mariana Islands"]="MP"
+        abbrev_to_state_name["MP"]="Northern Mariana Islands"
+        return state_name_to_abbrev, abbrev_to_state_name
+
+    url = Source_URLs["state_name_to_abbrev"] + " " + Source_URLs["abbrev_to_state_name"]
+    state_name_to_abbrev, abbrev_to_state_name = Get_Cache().fetch("abbrevs", url, build, Cache_Versions["abbrevs"],
+                                                                   Cache_TTL["abbrevs"], from_web)
     return state_name_to_abbrev, abbrev_to_state_name
 
+@profiled
 def Get_County_GEO(force_web=False):
-    """Load the county GEO shapes from the Plotly website. If the file exists locally, read it from
-    disk, unless force_we=True."""
+    """Load the county GEO shapes from the Plotly website. If the shapes are in the cache, read them from
+    disk, unless force_web=True."""
     # fips_state_code_url="https://www2.census.gov/programs-surveys/popest/geographies/2018/state-geocodes-v2018.xlsx"
     # pd_states=pd.read_excel(fips_state_code_url,header=5)
     # fips_county_codes=url="https://www2.census.gov/programs-surveys/popest/geographies/2018/all-geocodes-v2018.xlsx"
     # pd_counties=pd.read_excel("/Users/maurik/Downloads/all-geocodes-v2018.xlsx",header=4)
 
-    geo_file_name = "geojson-counties-fips.json"
-    try:
-        file_info = os.lstat(geo_file_name)
-    except:
-        file_info = None
+    def build():
+        return _json_loads(Fetch_URL(Source_URLs["county_geo"]))
 
-    if file_info is None or force_web:
-        geo_url = "https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json"
-        geo_dat = requests.get(geo_url)
-        with open(geo_file_name,'w') as output:
-            json.dump(geo_dat.json(),output)
-        return geo_dat.json()
+    return Get_Cache().fetch("county_geo", Source_URLs["county_geo"], build, Cache_Versions["county_geo"],
+                             Cache_TTL["county_geo"], True if force_web else None)
 
-    else:
-        with open(geo_file_name) as infile:
-            geo_dat_json = json.load(infile)
-        return geo_dat_json
 
+census_dtypes = {"SUMLEV": "int16", "REGION": "int8", "DIVISION": "int8", "STATE": "int8",
+                 "COUNTY": "int16", "STNAME": "category"}
 
-def Get_Census_All_data():
+@profiled
+def Get_Census_All_data(from_web=None):
     """Get the census data for all counties in the US from the Census bureau.
     Note: that their data does not include the fips code, so we need to add that.
     Note: This data should not change much, so the data is cached"""
@@ -80,118 +810,266 @@ def Get_Census_All_data():
     # https://www2.census.gov/programs-surveys/popest/technical-documentation/
     # file-layouts/2010-2019/co-est2019-alldata.pdf
 
-    detailed_census_data_url = "https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/counties/totals/co-est2019-alldata.csv"
-    try:
-        file_info = os.lstat("co-est2019-alldata.csv")
-    except:
-        file_info = None
-
-    if file_info is None:
-        census_pop_dat = pd.read_csv(detailed_census_data_url, encoding="ISO-8859-1")
-        census_pop_dat.to_csv("co-est2019-alldata.csv")  # Store it to reduce network traffic.
-    else:
-        census_pop_dat = pd.read_csv("co-est2019-alldata.csv")
-
-    census_pop_dat["fips"] = ["{:02d}{:03d}".format(census_pop_dat.iloc[i, census_pop_dat.columns.get_loc('STATE')],
-                                                    census_pop_dat.iloc[i, census_pop_dat.columns.get_loc('COUNTY')])
-                              for i in census_pop_dat.index]
+    # The processed table is cached, so the dtypes and the fips column are stored with it,
+    # and a warm start does not need to parse or fix up anything.
+    def build():
+        raw = Fetch_URL(Source_URLs["census"])
+        with Profile_Stage("parse") as record:
+            census_pop_dat = pd.read_csv(io.BytesIO(raw), encoding="ISO-8859-1")
+            record["rows"] = len(census_pop_dat)
+        with Profile_Stage("fips", rows=len(census_pop_dat)):
+            # The fips code is 2 digits for the state followed by 3 digits for the county.
+            census_pop_dat["fips"] = (census_pop_dat["STATE"].astype(np.int32)*1000 +
+                                      census_pop_dat["COUNTY"].astype(np.int32)).astype(str).str.zfill(5)
+            return Census_Compact_Dtypes(census_pop_dat)
+
+    return Get_Cache().fetch("census", Source_URLs["census"], build, Cache_Versions["census"],
+                             Cache_TTL["census"], from_web)
+
+
+def Census_Compact_Dtypes(census_pop_dat):
+    """Convert the census table to compact dtypes. The small code columns get the types in census_dtypes,
+    and the state name becomes a category. All other integer columns (population counts, births, etc.)
+    are kept as int64: with numpy 2 the sum or product of two int32 columns stays int32, and can overflow."""
+    census_pop_dat = census_pop_dat.astype(census_dtypes)
+    for col in census_pop_dat.columns:
+        if col not in census_dtypes and pd.api.types.is_integer_dtype(census_pop_dat[col]):
+            census_pop_dat[col] = census_pop_dat[col].astype(np.int64)
     return census_pop_dat
 
-def Get_Census_Data():
+
+@profiled
+def Get_Census_Data(from_web=None):
     """Get a reduced set of data from the Census for population numbers for 2019.
-    Note: This data should not change much, so the data is cached by Get_Census_All_Data().
+    Note: This data should not change much, so the data is cached. With from_web=True the full census
+          table is downloaded again, and the reduced set is made from it.
     Note: The data for Porto Rico (72), Guam (66), Northern Mariana Islands (69), Virgin Islands (78)
-          are added 'by hand' (too much trouble to download it!). """
-
-    census_pop_dat = Get_Census_All_data()
-
-    us_pop_dat= census_pop_dat.loc[:, ["SUMLEV", "REGION", "DIVISION", "STATE", "COUNTY", "fips", "STNAME",
-                                        "CTYNAME", "CENSUS2010POP", "POPESTIMATE2019"]]
-
-    us_pop_dat = us_pop_dat.append({"SUMLEV":40, "REGION":5, "DIVISION": 1, "STATE": 72, "COUNTY": 0,
-                                    "fips":'72000', "STNAME":"Puerto Rico", "CTYNAME":"Puerto Rico",
-                                    "CENSUS2010POP": 3726157, "POPESTIMATE2019": 3193694},ignore_index=True)
-
-    us_pop_dat = us_pop_dat.append({"SUMLEV":40, "REGION":5, "DIVISION": 2, "STATE": 66, "COUNTY": 0,
-                                    "fips":'66000', "STNAME":"Guam", "CTYNAME":"Guam",
-                                    "CENSUS2010POP": 159358, "POPESTIMATE2019": 167294},ignore_index=True)
-
-    us_pop_dat = us_pop_dat.append({"SUMLEV":40, "REGION":5, "DIVISION": 2, "STATE": 69, "COUNTY": 0,
-                                    "fips":'69000', "STNAME":"Northern Mariana Islands",
-                                    "CTYNAME":"Northern Mariana Islands",
-                                    "CENSUS2010POP": 53971, "POPESTIMATE2019": 57216},ignore_index=True)
-
-    us_pop_dat = us_pop_dat.append({"SUMLEV": 40, "REGION": 5, "DIVISION": 2, "STATE": 78, "COUNTY": 0,
-                                    "fips": '78000', "STNAME": "Virgin Islands",
-                                    "CTYNAME": "Virgin Islands",
-                                    "CENSUS2010POP": 106087, "POPESTIMATE2019": 104578}, ignore_index=True)
-
-
+          are added 'by hand' from Supplemental_Rows (too much trouble to download it!). """
+
+    def build():
+        census_pop_dat = Get_Census_All_data(from_web)
+        us_pop_dat = census_pop_dat.loc[:, ["SUMLEV", "REGION", "DIVISION", "STATE", "COUNTY", "fips", "STNAME",
+                                            "CTYNAME", "CENSUS2010POP", "POPESTIMATE2019"]]
+        us_pop_dat = Apply_Supplements(us_pop_dat, "census")
+        # Keep the compact dtypes after adding the extra rows.
+        return Census_Compact_Dtypes(us_pop_dat)
+
+    us_pop_dat = Get_Cache().fetch("census_data", Source_URLs["census"], build, Cache_Versions["census_data"],
+                                   Cache_TTL["census"], from_web)
     return us_pop_dat
 
 
 
-def Get_NYT_USA_Data(from_web=True):
-    if from_web:
-        # NYT Data from web:
-        NYT_covid_counties = "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv"
-        data_counties = pd.read_csv(NYT_covid_counties, parse_dates=[1], dtype={"fips": str},na_filter=False)
-        NYT_covid_states = "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv"
-        data_states = pd.read_csv(NYT_covid_states, parse_dates=[1],na_filter=False)
+NYT_base_url = "https://raw.githubusercontent.com/nytimes/covid-19-data/master/"
+# The NYT files in the local store. The key columns identify a row; the fips is empty for the "Unknown"
+# counties, so the county name is needed to make (date, fips) unique.
+NYT_sources = {"counties": ("us-counties.csv", ["date", "state", "county"]),
+               "states": ("us-states.csv", ["date", "state"])}
+NYT_full_refresh = 7*24*3600        # Seconds between full downloads, which pick up revisions of older rows.
+
+
+@profiled
+def Sync_NYT_Data(which="counties", store_dir=None, base_url=None, from_web=None):
+    """Return the NYT data for "counties" or "states", kept up to date in a local store in store_dir.
+    The NYT files mostly grow at the end, so after the first download we only ask for the bytes after the
+    part we already have, with a conditional request on the ETag/Last-Modified from the last sync.
+    If nothing changed the server answers "304 Not Modified" and no data is moved. If the server does not
+    honor the byte range, or the last bytes we stored have changed, the whole file is loaded again.
+    Note: only the end of the stored part is checked, so a revision of older rows is not seen by a delta sync.
+    Those are picked up by the full download every NYT_full_refresh seconds, or with from_web=True.
+    As for the other loaders, from_web=None only asks the server when the last check is older than
+    Cache_TTL["nyt"], from_web=False uses the store no matter how old it is, and from_web=True always
+    downloads the whole file.
+    The store is an entry of the cache, keyed on the url and Cache_Versions["nyt"], in the cache directory,
+    unless a store_dir is given. The base_url can point to any web server with the same files, for instance a
+    local test server."""
+    if store_dir is None:
+        store_dir = Get_Cache().cache_dir
+    if base_url is None:
+        base_url = NYT_base_url
+    file_name, key_columns = NYT_sources[which]
+    url = base_url + file_name
+    store_base = os.path.join(store_dir, os.path.basename(Get_Cache().entry_name("nyt_" + which, url,
+                                                                                 Cache_Versions["nyt"])))
+    meta_file = store_base + ".json"
+
+    meta = None
+    if os.path.exists(meta_file):
+        with open(meta_file) as infile:
+            meta = json.load(infile)
+        if "frame" not in meta or not os.path.exists(os.path.join(store_dir, meta["frame"]["file"])):
+            meta = None
+    if from_web is True:
+        meta = None
+    elif meta is not None and (from_web is False or time.time() - meta["checked"] <= Cache_TTL["nyt"]):
+        Get_Cache()._count("hits")
+        with Profile_Stage("store_load"):
+            data = Read_Frame(meta["frame"], store_dir)
+        os.utime(meta_file)   # Mark as recently used, for the eviction of the cache.
+        return data
+    elif meta is not None and time.time() - meta["full_sync"] > NYT_full_refresh:
+        meta = None
+
+    headers = {}
+    if meta is not None:
+        if meta["etag"]:
+            headers["If-None-Match"] = meta["etag"]
+        if meta["last_modified"]:
+            headers["If-Modified-Since"] = meta["last_modified"]
+        # Ask for the end of the file, starting a little before the end of the stored part, so we can
+        # check that the part we have is still the same.
+        headers["Range"] = "bytes={}-".format(meta["nbytes"] - len(meta["tail"]))
+        headers["Accept-Encoding"] = "identity"   # Byte ranges of a compressed response are useless.
+
+    session = Get_Session()
+    with Profile_Stage("download") as record:
+        response = session.get(url, headers=headers)
+        record["bytes"] = len(response.content)
+    if response.status_code == 304:
+        Get_Cache()._count("hits")
+        with Profile_Stage("store_load"):
+            data = Read_Frame(meta["frame"], store_dir)
+        meta["checked"] = time.time()
+        _atomic_write(meta_file, lambda output: output.write(json.dumps(meta).encode()))
+        return data
+    Get_Cache()._count("misses")
+    if response.status_code == 416:    # Range not satisfiable, the file got shorter.
+        with Profile_Stage("download") as record:
+            response = session.get(url)
+            record["bytes"] = len(response.content)
+    response.raise_for_status()
+
+    content = response.content
+    tail = meta["tail"].encode("latin-1") if meta is not None else b""
+    changed = True     # False if the stored frame is still complete, then only the meta file is updated.
+    if meta is not None and response.status_code == 206 and content.startswith(tail):
+        nbytes = int(response.headers["Content-Range"].split("/")[-1])
+        with Profile_Stage("store_load"):
+            stored = Read_Frame(meta["frame"], store_dir)
+        new_bytes = content[len(tail):]
+        if len(new_bytes):
+            with Profile_Stage("parse") as record:
+                new_rows = pd.read_csv(io.BytesIO(meta["header"].encode("latin-1") + new_bytes),
+                                       parse_dates=["date"], dtype={"fips": str}, na_filter=False)
+                record["rows"] = len(new_rows)
+            # Only dates newer than what is stored are appended.
+            new_rows = new_rows.loc[new_rows["date"] > pd.Timestamp(meta["last_date"])]
+            new_rows = new_rows.drop_duplicates(subset=key_columns, keep="last")
+        if len(new_bytes) and len(new_rows):
+            data = pd.concat([stored, new_rows], ignore_index=True)
+        else:
+            data = stored
+            changed = False
     else:
-        # If you got the data locally using: git clone https://github.com/nytimes/covid-19-data.git
-        # then use these lines to read it in. Otherwise, comment out these lines and use the ones above.
-        data_states=pd.read_csv("us-states.csv", parse_dates=[1], dtype={"fips": str}, na_filter=False)
-        data_counties=pd.read_csv("us-counties.csv",parse_dates=[1],na_filter=False)
-
-
-    # The data has some locations without a fips, so add a fake one.
-    data_counties.loc[data_counties["county"] == "New York City", "fips"] = 36999   # New York City region
-    data_counties.loc[data_counties["county"] == "Kansas City", "fips"] = 29999
+        if response.status_code == 206:    # The old part changed, so get everything.
+            with Profile_Stage("download") as record:
+                response = session.get(url)
+                response.raise_for_status()
+                content = response.content
+                record["bytes"] = len(content)
+        nbytes = len(content)
+        with Profile_Stage("parse") as record:
+            data = pd.read_csv(io.BytesIO(content), parse_dates=["date"], dtype={"fips": str}, na_filter=False)
+            record["rows"] = len(data)
+        meta = {"header": content[:content.index(b"\n") + 1].decode("latin-1"), "full_sync": time.time()}
+
+    if len(content) > 0:
+        meta["tail"] = content[-min(len(content), 256):].decode("latin-1")
+    meta["nbytes"] = nbytes
+    meta["etag"] = response.headers.get("ETag")
+    meta["last_modified"] = response.headers.get("Last-Modified")
+    meta["last_date"] = data["date"].max().isoformat() if len(data) else "1970-01-01"
+    meta["checked"] = time.time()
+
+    if changed:
+        with Profile_Stage("store_write", rows=len(data)):
+            meta["frame"] = Write_Frame(data, store_base, Get_Cache().fmt)
+        # The store is an entry of the cache, so it counts for the size limit, and is evicted when least
+        # recently used.
+        meta["files"] = [meta["frame"]["file"]]
+        meta["size"] = os.path.getsize(os.path.join(store_dir, meta["frame"]["file"]))
+    _atomic_write(meta_file, lambda output: output.write(json.dumps(meta).encode()))
+    if os.path.abspath(store_dir) == os.path.abspath(Get_Cache().cache_dir):
+        Get_Cache().evict(keep=store_base)
+    return data
+
+
+def Fix_County_Fips(data_counties, state_fips):
+    """Give the NYT county locations without a fips code a fake one. New York City and Kansas City get
+    36999 and 29999, the "Unknown" counties get 1000*(state fips) + 998. The state_fips is a dictionary
+    from state name to the integer state fips code."""
+    data_counties.loc[data_counties["county"] == "New York City", "fips"] = "36999"   # New York City region
+    data_counties.loc[data_counties["county"] == "Kansas City", "fips"] = "29999"
     # The rest are "Unknown" counties
-    for i in data_counties.loc[data_counties["fips"] == ""].index:
-        fips=1000*int(data_states.loc[data_states["state"] == data_counties.loc[i, "state"], "fips"].values[0])+998
-        data_counties.loc[i, "fips"] = str(fips)
-
-    state_name_to_abbrev, abbrev_to_state_name = Get_Abbrevs()
-    # add abbreviation to each state.
-
-    tmp_st=[]
-    for name in data_states.loc[:, "state"]:
-        try:
-            tmp_st_name=state_name_to_abbrev[name.title()]
-        except KeyError:
+    unknown = data_counties["fips"] == ""
+    if unknown.any():
+        fake = data_counties.loc[unknown, "state"].map(state_fips)*1000 + 998
+        data_counties.loc[unknown, "fips"] = fake.astype("Int64").astype(str).replace("<NA>", "")
+    return data_counties
+
+
+def Add_State_Abbrev(data, state_name_to_abbrev):
+    """Add a column 'st' with the state abbreviation, looked up from the 'state' column."""
+    st = data["state"].str.title().map(state_name_to_abbrev)
+    missing = st.isna()
+    if missing.any():
+        for name in data.loc[missing, "state"].unique():
             print("The new name {} is not yet handled properly. ".format(name))
-            tmp_st_name="NA"
-        tmp_st.append(tmp_st_name)
+    data['st'] = st.fillna("NA")
+    return data
+
+
+@profiled
+def Get_NYT_USA_Data(from_web=None, compact=False, local_dir=None):
+    """Get the NYT COVID19 data for the US states and counties, with the state abbreviation and population added.
+    As for the other loaders, from_web=None uses the cached data while it is fresh, from_web=False uses the
+    cached data no matter how old, and from_web=True downloads everything again. See Sync_NYT_Data().
+    With local_dir the NYT files are read from that directory, e.g. from a git clone of the NYT repository.
+    With compact=True the frames are converted with Compact_NYT_Frame(), which uses much less memory."""
+    # All the sources are independent, so they are fetched at the same time.
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        abbrevs = pool.submit(contextvars.copy_context().run, Get_Abbrevs, from_web)
+        census = pool.submit(contextvars.copy_context().run, Get_Census_Data, from_web)
+        if local_dir is None:
+            # NYT Data from web, synced into a local store so only the new days are downloaded.
+            counties = pool.submit(contextvars.copy_context().run, Sync_NYT_Data, "counties", from_web=from_web)
+            states = pool.submit(contextvars.copy_context().run, Sync_NYT_Data, "states", from_web=from_web)
+            data_counties = counties.result()
+            data_states = states.result()
+        else:
+            # If you got the data locally using: git clone https://github.com/nytimes/covid-19-data.git
+            # then give the directory of the clone as local_dir.
+            data_states=pd.read_csv(os.path.join(local_dir, "us-states.csv"), parse_dates=[1], dtype={"fips": str},
+                                    na_filter=False)
+            data_counties=pd.read_csv(os.path.join(local_dir, "us-counties.csv"),parse_dates=[1],na_filter=False)
+        state_name_to_abbrev, abbrev_to_state_name = abbrevs.result()
+        us_pop_dat = census.result()
 
-    data_states.loc[:, 'st'] = tmp_st # [state_name_to_abbrev[name.title()] for name in data_states.loc[:, "state"]]
 
-    tmp_st = []
-    for name in data_counties.loc[:, "state"]:
-        try:
-            tmp_st_name = state_name_to_abbrev[name.title()]
-        except KeyError:
-            print("The new county state name {} is not yet handled properly. ".format(name))
-            tmp_st_name = "NA"
-        tmp_st.append(tmp_st_name)
+    # The data has some locations without a fips, so add a fake one.
+    with Profile_Stage("fix_fips", rows=len(data_counties)):
+        state_fips = dict(zip(data_states["state"], data_states["fips"].astype(int)))
+        data_counties = Fix_County_Fips(data_counties, state_fips)
 
-    data_counties.loc[:, 'st'] = tmp_st # [state_name_to_abbrev[name.title()] for name in data_counties.loc[:, "state"]]
+    # add abbreviation to each state.
+    with Profile_Stage("abbrev", rows=len(data_states) + len(data_counties)):
+        data_states = Add_State_Abbrev(data_states, state_name_to_abbrev)
+        data_counties = Add_State_Abbrev(data_counties, state_name_to_abbrev)
     #
     # Add population counts
     #
-    us_pop_dat = Get_Census_Data()
-    states_pop_dat = us_pop_dat.loc[us_pop_dat["COUNTY"] == 0]
-    # Temporarily add a "STATE" column with integer state codes:
-    data_states["STATE"] = [int(i) for i in data_states["fips"]]
-    data_states = pd.merge(data_states, states_pop_dat[["STATE", "POPESTIMATE2019"]], on="STATE", how="left")
-    # Drop the temporary column
-    data_states.drop(columns=["STATE"], inplace=True)
-    # rename the new column.
-    data_states.rename(columns={"POPESTIMATE2019": "pop"}, inplace=True)  # Temprary rename for merge.
-
-    data_counties = pd.merge(data_counties, us_pop_dat[["fips", "POPESTIMATE2019"]], on="fips", how="left")
-    data_counties.rename(columns={"POPESTIMATE2019": "pop"}, inplace=True)
+    with Profile_Stage("merge_pop", rows=len(data_states) + len(data_counties)):
+        states_pop_dat = us_pop_dat.loc[us_pop_dat["COUNTY"] == 0]
+        # Temporarily add a "STATE" column with integer state codes:
+        data_states["STATE"] = data_states["fips"].astype(int)
+        data_states = pd.merge(data_states, states_pop_dat[["STATE", "POPESTIMATE2019"]], on="STATE", how="left")
+        # Drop the temporary column
+        data_states.drop(columns=["STATE"], inplace=True)
+        # rename the new column.
+        data_states.rename(columns={"POPESTIMATE2019": "pop"}, inplace=True)  # Temprary rename for merge.
+
+        data_counties = pd.merge(data_counties, us_pop_dat[["fips", "POPESTIMATE2019"]], on="fips", how="left")
+        data_counties.rename(columns={"POPESTIMATE2019": "pop"}, inplace=True)
 
     #
     # The below commented code does the same, adding a population column. Is it more than a 1000 times slower.
@@ -218,6 +1096,7 @@ def Get_NYT_USA_Data(from_web=True):
     # Add hover text
     # This is most time consuming step in this routine, we skip it, because it is
     # not needed for every date, and the needed info may change.
+    # Use Hover_Text() to get it for all rows, or ChoroplethFrames to get it for each date on request.
     #
     # data_states.loc[:, 'text'] = [data_states.loc[d, 'state'] + '<br>' +
     #                               'pop:'+ str(data_states.loc[d, 'pop']) + '<br>' +
@@ -236,100 +1115,175 @@ def Get_NYT_USA_Data(from_web=True):
     data_states.this_date = data_states.loc[:, 'date'].unique()[-1]
     data_counties.this_date = data_counties.loc[:, 'date'].unique()[-1]
 
+    if compact:
+        data_states = Compact_NYT_Frame(data_states)
+        data_counties = Compact_NYT_Frame(data_counties)
+
     return data_states, data_counties
 
+def Stream_NYT_Counties(source=None, chunksize=100000, by_date=False):
+    """Generator that reads the NYT county data in chunks of chunksize rows and yields each chunk with
+    the fips fixed, the state abbreviation 'st', the 'pop' and the 'datetime' added, the same as the
+    counties from Get_NYT_USA_Data(). Only one chunk is in memory at a time, so the data can be aggregated
+    or written out in constant memory no matter how long the history is.
+    With by_date=True each yielded frame holds all the rows of exactly one date.
+    The source can be a file name or a URL, and defaults to us-counties.csv on the NYT site."""
+    if source is None:
+        source = NYT_base_url + NYT_sources["counties"][0]
+
+    state_name_to_abbrev, abbrev_to_state_name = Get_Abbrevs()
+    us_pop_dat = Get_Census_Data()
+    states_pop_dat = us_pop_dat.loc[us_pop_dat["COUNTY"] == 0]
+    state_fips = dict(zip(states_pop_dat["STNAME"].astype(str), states_pop_dat["STATE"].astype(int)))
+    county_pop = us_pop_dat[["fips", "POPESTIMATE2019"]].rename(columns={"POPESTIMATE2019": "pop"})
+
+    def process(chunk):
+        chunk = Fix_County_Fips(chunk, state_fips)
+        chunk = Add_State_Abbrev(chunk, state_name_to_abbrev)
+        chunk = pd.merge(chunk, county_pop, on="fips", how="left")
+        chunk['datetime'] = pd.to_datetime(chunk['date'])
+        return chunk
+
+    left_over = None
+    for chunk in pd.read_csv(source, chunksize=chunksize, dtype={"fips": str}, na_filter=False):
+        if not by_date:
+            yield process(chunk)
+            continue
+        # The file is sorted by date, so only the last date in the chunk can continue in the next chunk.
+        if left_over is not None:
+            chunk = pd.concat([left_over, chunk], ignore_index=True)
+        last_date = chunk["date"].iloc[-1]
+        left_over = chunk.loc[chunk["date"] == last_date]
+        chunk = chunk.loc[chunk["date"] != last_date]
+        for date, group in chunk.groupby("date", sort=False):
+            yield process(group.reset_index(drop=True))
+
+    if left_over is not None and len(left_over):
+        yield process(left_over.reset_index(drop=True))
+
+
 # Fixup some name oddities by adding additional entries
 def country_codes_fix(country_codes,old,new):
 
     if len(country_codes.loc[country_codes['name'] == new ]):
         print("{} is already OK.".format(new))
-        return
+        return country_codes
 
     add = country_codes.loc[country_codes['name'] == old].copy()
     add['name'] = new
-    country_codes = country_codes.append(add, ignore_index=True)
+    country_codes = pd.concat([country_codes, add], ignore_index=True)
     return country_codes
 
-def Get_Country_Codes(from_web=True):
+def _build_country_codes(raw):
+    """Return the country code table from the downloaded json."""
+    country_codes = pd.read_json(io.BytesIO(raw))
+
+    # Fixes by adding additional names for countries, and the pseudo countries.
+    return Apply_Supplements(country_codes, "country_codes")
+
+
+@profiled
+def Get_Country_Codes(from_web=None):
     """Get the 3 letter country code abbreviations, and fix up that data"""
     # Get a list of Names with the 3 letter country codes.
     # See: https://github.com/lukes/ISO-3166-Countries-with-Regional-Codes
     # And: https://en.wikipedia.org/wiki/ISO_3166-1_alpha-3
     #
-    if from_web:
-        url_country_codes="https://raw.githubusercontent.com/lukes/ISO-3166-Countries-with-Regional-Codes/master/slim-3/slim-3.json"
-        country_codes = pd.read_json(url_country_codes)
-
-        # Fixes by adding additional names for countries.
-        country_codes = country_codes_fix(country_codes, 'Bolivia (Plurinational State of)', 'Bolivia')
-        country_codes = country_codes_fix(country_codes, 'Brunei Darussalam', 'Brunei')
-        country_codes = country_codes_fix(country_codes, "Côte d'Ivoire", "Cote d'Ivoire")
-        country_codes = country_codes_fix(country_codes, "Iran (Islamic Republic of)", 'Iran')
-        country_codes = country_codes_fix(country_codes, "Korea, Republic of", 'Korea, South')
-        country_codes = country_codes_fix(country_codes, "Moldova, Republic of", 'Moldova')
-        country_codes = country_codes_fix(country_codes, "Russian Federation", "Russia")
-        country_codes = country_codes_fix(country_codes, "Taiwan, Province of China", "Taiwan*")
-        country_codes = country_codes_fix(country_codes, "Tanzania, United Republic of", "Tanzania")
-        country_codes = country_codes_fix(country_codes, "United Kingdom of Great Britain and Northern Ireland",
-                                          "United Kingdom")
-        country_codes = country_codes_fix(country_codes, "United States of America", "US")
-        country_codes = country_codes_fix(country_codes, "Venezuela (Bolivarian Republic of)", "Venezuela")
-        country_codes = country_codes_fix(country_codes, "Viet Nam", "Vietnam")
-        country_codes = country_codes_fix(country_codes, "Syrian Arab Republic", "Syria")
-        country_codes = country_codes_fix(country_codes, "Lao People's Democratic Republic", "Laos")
-        country_codes = country_codes_fix(country_codes, "Palestine, State of", "West Bank and Gaza")
-        country_codes = country_codes_fix(country_codes, "Myanmar", "Burma")
-        country_codes = country_codes=country_codes.append({'name':'Other', 'alpha-3':'XXX', "country-code":999},
-                                                           ignore_index=True)
-        country_codes = country_codes.append({'name': 'Diamond Princess', 'alpha-3': 'XX1', "country-code": 991},
-                                             ignore_index=True)
-        country_codes = country_codes.append({'name': 'Kosovo', 'alpha-3': 'XX2', "country-code": 992},
-                                             ignore_index=True)
-        country_codes = country_codes.append({'name': 'MS Zaandam', 'alpha-3': 'XX3', "country-code": 993},
-                                             ignore_index=True)
-
-        country_codes.to_csv("country_codes.csv")
-    else:
-        country_codes = pd.read_csv("country_codes.csv",index_col=0)
+    def build():
+        return _build_country_codes(Fetch_URL(Source_URLs["country_codes"]))
 
-    return country_codes
-
-def Get_World_Pop_Data(from_web=True):
-    """Get the data for the world population by country from the worldbank.org"""
+    return Get_Cache().fetch("country_codes", Source_URLs["country_codes"], build, Cache_Versions["country_codes"],
+                             Cache_TTL["country_codes"], from_web)
 
-    world_pop_url = "http://api.worldbank.org/v2/en/indicator/SP.POP.TOTL?downloadformat=excel"
-    if from_web:
-        world_pop = pd.read_excel(world_pop_url,skiprows=3)
-        world_pop.rename(columns={'Country Code': 'code', 'Country Name': 'Country'}, inplace=True)
-        world_pop = world_pop.append(
-    [{"Country": "Taiwan", "code": "TWN", "Indicator Name": "Population, total","2018": 23816775},
-     {"Country": "Holy See", "code": "VAT", "Indicator Name": "Population total","2018":801},
-     {"Country": "Western Sahara", "code": "ESH", "Indicator Name": "Population total", "2018":597339}
-        ],
-            ignore_index=True)
 
-        world_pop.to_csv("world_pop.csv")
+class CountryCodeResolver(object):
+    """Map country names, as used by JHU, to the 3 letter country codes.
+    The lookup table is a dictionary, built once from the Get_Country_Codes() table and the
+    country_name_aliases, so a whole column is mapped in one pass instead of one search per row."""
 
-    else:
-        world_pop = pd.read_csv("world_pop.csv",index_col=0)
+    def __init__(self, country_codes=None, default_code='XXX'):
+        if country_codes is None:
+            country_codes = Get_Country_Codes()
 
-    return(world_pop)
+        self.default_code = default_code
+        self.name_to_code = dict(zip(country_codes['name'], country_codes['alpha-3']))
+        # Make sure the aliases are there, even for tables that were stored before the fixes were added.
+        for old, new in country_name_aliases:
+            if new not in self.name_to_code and old in self.name_to_code:
+                self.name_to_code[new] = self.name_to_code[old]
+        self.unmatched = []
+
+    def resolve(self, names):
+        """Return a Series with the country code for each of the names. Names that are not known
+        get the default_code and are listed in self.unmatched, together with the number of rows."""
+        names = pd.Series(names)
+        codes = names.map(self.name_to_code)
+        missing = codes.isna()
+        self.unmatched = sorted(names[missing].value_counts().items())
+        return codes.fillna(self.default_code)
+
+    def report(self):
+        """Return a printable report of the names that could not be matched in the last resolve()."""
+        if not self.unmatched:
+            return "All country names were matched."
+        lines = ["{} country name(s) not matched, code set to {}:".format(len(self.unmatched), self.default_code)]
+        for name, count in self.unmatched:
+            lines.append("   {} ({} rows)".format(name, count))
+        return "\n".join(lines)
+
+
+@profiled
+def Get_World_Pop_Data(from_web=None):
+    """Get the data for the world population by country from the worldbank.org"""
 
+    def build():
+        world_pop = pd.read_excel(io.BytesIO(Fetch_URL(Source_URLs["world_pop"])),skiprows=3)
+        world_pop.rename(columns={'Country Code': 'code', 'Country Name': 'Country'}, inplace=True)
+        return Apply_Supplements(world_pop, "world_pop")
 
-def Get_Global_data(country_codes=None,from_web=True):
-    """Get the global COVID19 data from John Hopkins University."""
+    world_pop = Get_Cache().fetch("world_pop", Source_URLs["world_pop"], build, Cache_Versions["world_pop"],
+                                  Cache_TTL["world_pop"], from_web)
+    return(world_pop)
 
-    if from_web:
 
-        if country_codes is None:
-            country_codes = Get_Country_Codes()
-        
-        data_global_url = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv"
-        data_global = pd.read_csv(data_global_url)
-        deaths_global_url = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv"
-        deaths_global = pd.read_csv(deaths_global_url)
-        recovered_global_url = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv"
-        recovered_global = pd.read_csv(recovered_global_url)
+@profiled
+def Get_Global_data(country_codes=None,from_web=None, compact=False):
+    """Get the global COVID19 data from John Hopkins University.
+    The country_codes can be the table from Get_Country_Codes() or a CountryCodeResolver, so
+    that the same resolver can be re-used for several loads.
+    With compact=True the frames are converted with Compact_JHU_Frame(), which uses much less memory."""
+
+    url = " ".join([Source_URLs["jhu_confirmed"], Source_URLs["jhu_deaths"], Source_URLs["jhu_recovered"]])
+    resolver = None
+    if country_codes is not None:
+        resolver = country_codes if isinstance(country_codes, CountryCodeResolver) else \
+            CountryCodeResolver(country_codes)
+        # Another code table gives other codes, so it is part of the key of the cache entry.
+        table = "|".join(sorted("{}={}".format(k, v) for k, v in resolver.name_to_code.items()))
+        url += " codes:" + hashlib.sha1((table + "|" + resolver.default_code).encode()).hexdigest()[:16]
+
+    def build():
+        nonlocal resolver
+        urls = [Source_URLs["jhu_confirmed"], Source_URLs["jhu_deaths"], Source_URLs["jhu_recovered"]]
+        country_codes = None
+        if resolver is None:
+            # The code table comes from the cache if it is fresh there, else it is downloaded with the JHU files.
+            country_codes = Get_Cache().load("country_codes", Source_URLs["country_codes"],
+                                             Cache_Versions["country_codes"], Cache_TTL["country_codes"])
+            if country_codes is None:
+                urls.append(Source_URLs["country_codes"])
+
+        # The files are downloaded at the same time.
+        raw = Fetch_All(urls)
+        if resolver is None:
+            if country_codes is None:
+                country_codes = _build_country_codes(raw[3])
+                Get_Cache().store("country_codes", Source_URLs["country_codes"], Cache_Versions["country_codes"],
+                                  country_codes)
+            resolver = CountryCodeResolver(country_codes)
+        with Profile_Stage("parse") as record:
+            data_global, deaths_global, recovered_global = [pd.read_csv(io.BytesIO(r)) for r in raw[:3]]
+            record["rows"] = len(data_global) + len(deaths_global) + len(recovered_global)
 
         # Fixup some data inconsistencies.
         try:
@@ -374,50 +1328,39 @@ def Get_Global_data(country_codes=None,from_web=True):
         except:
             print("You may have run this one before, so data is already fixed?")
 
-        data_global.this_date = data_global.keys()[-1]  # Save the last date from the keys.
-        deaths_global.this_data = deaths_global.keys()[-1]
-        recovered_global.this_data = recovered_global.keys()[-1]
-
         # Add a new column with the country codes, which we look up from the table.
-        data_global['code'] = 'XXX'
-        deaths_global['code'] = 'XXX'
-        recovered_global['code'] = 'XXX'
-        code_id = data_global.columns.get_loc('code')
+        with Profile_Stage("country_codes") as record:
+            for dat in (data_global, deaths_global, recovered_global):
+                dat['code'] = resolver.resolve(dat['Country/Region']).values
+                if resolver.unmatched:
+                    print(resolver.report())
+            record["rows"] = len(data_global) + len(deaths_global) + len(recovered_global)
 
-        for i in range(len(data_global)):
-            data_global.iloc[i, code_id] = \
-            country_codes.loc[country_codes['name'] == data_global.iloc[i]['Country/Region'], 'alpha-3'].iloc[0]
+        return data_global, deaths_global, recovered_global
 
-        code_id = deaths_global.columns.get_loc('code')
-        for i in range(len(deaths_global)):
-            deaths_global.iloc[i, code_id] = \
-            country_codes.loc[country_codes['name'] == deaths_global.iloc[i]['Country/Region'], 'alpha-3'].iloc[0]
+    data_global, deaths_global, recovered_global = Get_Cache().fetch("jhu_global", url, build,
+                                                                     Cache_Versions["jhu_global"],
+                                                                     Cache_TTL["jhu_global"], from_web)
 
-        code_id = recovered_global.columns.get_loc('code')
-        for i in range(len(recovered_global)):
-            recovered_global.iloc[i, code_id] = \
-            country_codes.loc[country_codes['name'] == recovered_global.iloc[i]['Country/Region'], 'alpha-3'].iloc[0]
-
-        data_global.to_csv("time_series_covid19_confirmed_global.csv")
-        deaths_global.to_csv("time_series_covid19_deaths_global.csv")
-        recovered_global.to_csv("time_series_covid19_recovered_global.csv")
-
-    else:
-        data_global = pd.read_csv("time_series_covid19_confirmed_global.csv", index_col=0)
-        deaths_global = pd.read_csv("time_series_covid19_deaths_global.csv", index_col=0)
-        recovered_global = pd.read_csv("time_series_covid19_recovered_global.csv", index_col=0)
+    # Save the last date from the keys, which is the column just before the 'code' column.
+    for dat in (data_global, deaths_global, recovered_global):
+        dat.this_date = dat.columns[dat.columns.get_loc('code') - 1]
 
+    if compact:
+        data_global, deaths_global, recovered_global = [Compact_JHU_Frame(dat) for dat in
+                                                        (data_global, deaths_global, recovered_global)]
 
     return data_global, deaths_global, recovered_global
 
 
+@profiled
 def Sum_data(data_global,deaths_global,recovered_global,country_codes):
     """Return the data summed over the country codes, so all data from the same country is added up."""
-    sum_global = data_global.groupby(['code'],as_index=False).sum()
+    sum_global = data_global.groupby(['code'],as_index=False,observed=True).sum(numeric_only=True)
     sum_global.drop(columns=['Lat', 'Long'], inplace=True)
-    sum_deaths = deaths_global.groupby(['code'],as_index=False).sum()
+    sum_deaths = deaths_global.groupby(['code'],as_index=False,observed=True).sum(numeric_only=True)
     sum_deaths.drop(columns=['Lat', 'Long'], inplace=True)
-    sum_recovered = recovered_global.groupby(['code'],as_index=False).sum()
+    sum_recovered = recovered_global.groupby(['code'],as_index=False,observed=True).sum(numeric_only=True)
     sum_recovered.drop(columns=['Lat', 'Long'], inplace=True)
 
     # Don't loose the "this_date" if it was added.
@@ -432,6 +1375,7 @@ def Sum_data(data_global,deaths_global,recovered_global,country_codes):
 
     return sum_global, sum_deaths, sum_recovered
 
+@profiled
 def Add_Population_Data(indat,inpop,colpop="2018"):
     """Add a column for population data from inpop data table using column colpop (defaults to '2018')
        Note that inpop must have the matching 'code' for the country codes. This method is a simple merge operation.
@@ -444,3 +1388,746 @@ def Add_Population_Data(indat,inpop,colpop="2018"):
         result.this_date = indat.this_date
     return result
 
+
+#
+# Compact versions of the frames. The names become categories, the counts use the smallest integer
+# type that can hold them, and the fips code is an integer.
+#
+def Downcast_Counts(column):
+    """Return the column with counts as the smallest integer type that holds all the values.
+    If there are missing values, the pandas nullable integer type of that size is used."""
+    column = pd.to_numeric(column, errors="coerce")
+    if column.isna().any():
+        small = pd.to_numeric(column.dropna(), downcast="integer")
+        if pd.api.types.is_integer_dtype(small):
+            return column.astype(small.dtype.name.capitalize())   # e.g. int32 -> Int32
+        return column
+    return pd.to_numeric(column, downcast="integer")
+
+
+def Compact_NYT_Frame(data):
+    """Return a compact copy of a frame from Get_NYT_USA_Data(). The state, county and st columns become
+    categories, the fips becomes an integer, the cases, deaths and pop use the smallest integer type,
+    and the 'date' string column is replaced by the 'datetime' column, which is renamed to 'date'."""
+    out = pd.DataFrame(index=data.index)
+    for col in data.columns:
+        if col in ("state", "county", "st"):
+            out[col] = data[col].astype("category")
+        elif col == "fips":
+            out[col] = Downcast_Counts(data[col])
+        elif col in ("cases", "deaths", "pop"):
+            out[col] = Downcast_Counts(data[col])
+        elif col == "date":
+            out[col] = data["datetime"] if "datetime" in data.columns else pd.to_datetime(data[col])
+        elif col != "datetime":
+            out[col] = data[col]
+    if 'this_date' in data.__dict__:
+        out.this_date = data.this_date
+    return out
+
+
+def Compact_JHU_Frame(data):
+    """Return a compact copy of a (wide) frame from Get_Global_data(). The name and code columns become
+    categories, Lat and Long are float32, and the date columns use the smallest integer type."""
+    out = {}
+    for col in data.columns:
+        if col in ("Province/State", "Country/Region", "code"):
+            out[col] = data[col].astype("category")
+        elif col in ("Lat", "Long"):
+            out[col] = data[col].astype(np.float32)
+        else:
+            out[col] = Downcast_Counts(data[col])
+    out = pd.DataFrame(out, index=data.index)
+    if 'this_date' in data.__dict__:
+        out.this_date = data.this_date
+    return out
+
+
+def Memory_Report(original, compact):
+    """Return a table comparing the memory use, per column, of the original and the compact frame."""
+    before = original.memory_usage(deep=True, index=False)
+    after = compact.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({"original_dtype": original.dtypes.astype(str), "original_bytes": before})
+    report = report.join(pd.DataFrame({"compact_dtype": compact.dtypes.astype(str), "compact_bytes": after}),
+                         how="outer")
+    report.loc["total"] = ["", before.sum(), "", after.sum()]
+    report["ratio"] = report["original_bytes"]/report["compact_bytes"]
+    return report
+
+
+#
+# Derived metrics: daily new counts, rolling averages, per capita numbers and doubling times.
+# These are computed for all the regions at once, with grouped operations on the time series sorted
+# by region and date, instead of a loop over the regions.
+#
+Derived_Keys = {"county": "fips", "state": "fips", "country": "code"}
+
+
+def JHU_To_Long(data, value_name="cases"):
+    """Convert a wide JHU frame, with one column per date, into a long frame with one row per
+    region and date, a 'datetime' column and the counts in the column value_name."""
+    dates = pd.to_datetime(pd.Index(data.columns).astype(str), format="%m/%d/%y", errors="coerce")
+    date_columns = [c for c, d in zip(data.columns, dates) if not pd.isna(d)]
+    id_columns = [c for c in data.columns if c not in date_columns]
+    out = data.melt(id_vars=id_columns, value_vars=date_columns, var_name="date", value_name=value_name)
+    out["datetime"] = pd.to_datetime(out["date"], format="%m/%d/%y")
+    return out
+
+
+def Add_Derived_Metrics(data, key, value_columns=("cases", "deaths"), date_column="datetime", pop_column="pop",
+                        window=7):
+    """Return a copy of the long time series data, sorted by key and date, with for each of the value_columns:
+    new_<col>: the daily new count, new_<col>_avg: the average of new_<col> over the last window rows,
+    <col>_per100k and new_<col>_avg_per100k: the same per 100,000 people (if there is a pop_column), and
+    <col>_doubling: the doubling time in days, from the growth over the last window rows."""
+    if date_column not in data.columns:
+        date_column = "date"
+    out = data.sort_values([key, date_column], kind="stable", ignore_index=True)
+    groups = out.groupby(key, sort=False, observed=True)
+    # Number of rows, up to window, that go into the rolling average.
+    n_avg = np.minimum(groups.cumcount().to_numpy() + 1, window)
+    for col in value_columns:
+        value = out[col].astype(np.float64)
+        new = groups[col].diff().fillna(value)    # The first day of a region counts as all new.
+        out["new_" + col] = new
+        # The rolling sum is the difference of the cumulative sum and the one window rows earlier.
+        cum = new.groupby(out[key], sort=False, observed=True).cumsum()
+        cum_before = cum.groupby(out[key], sort=False, observed=True).shift(window).fillna(0.)
+        out["new_" + col + "_avg"] = (cum - cum_before)/n_avg
+        if pop_column in out.columns:
+            pop = out[pop_column].astype(np.float64)
+            out[col + "_per100k"] = value/pop*1.e5
+            out["new_" + col + "_avg_per100k"] = out["new_" + col + "_avg"]/pop*1.e5
+        value_before = groups[col].shift(window).astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            growth = np.log(value/value_before)
+            out[col + "_doubling"] = np.where(growth > 0, window*np.log(2.)/growth, np.inf)
+    if 'this_date' in data.__dict__:
+        out.this_date = data.this_date
+    return out
+
+
+def Update_Derived_Metrics(metrics, new_rows, key, value_columns=("cases", "deaths"), date_column="datetime",
+                           pop_column="pop", window=7):
+    """Add the derived metrics for new_rows, which are dates newer than those in metrics, to the metrics.
+    Only the last window rows of each region are needed to compute the metrics of the new rows, so this
+    is much faster than recomputing everything."""
+    if date_column not in metrics.columns:
+        date_column = "date"
+    tail = metrics.groupby(key, sort=False, observed=True).tail(window)[new_rows.columns]
+    tail_index = pd.MultiIndex.from_frame(tail[[key, date_column]])
+    update = Add_Derived_Metrics(pd.concat([tail, new_rows], ignore_index=True), key, value_columns,
+                                 date_column, pop_column, window)
+    update = update.loc[~pd.MultiIndex.from_frame(update[[key, date_column]]).isin(tail_index)]
+    out = pd.concat([metrics, update], ignore_index=True)
+    out = out.sort_values([key, date_column], kind="stable", ignore_index=True)
+    if 'this_date' in new_rows.__dict__:
+        out.this_date = new_rows.this_date
+    return out
+
+
+def _same_rows(metrics, data, key, value_columns, date_column):
+    """Return True if the data has the same regions, dates and values as the (sorted) metrics were made from."""
+    if len(metrics) != len(data):
+        return False
+    data = data.sort_values([key, date_column], kind="stable")
+    for col in (key, date_column) + tuple(value_columns):
+        a, b = metrics[col].to_numpy(), data[col].to_numpy()
+        if not np.array_equal(a, b, equal_nan=a.dtype.kind == b.dtype.kind == "f"):
+            return False
+    return True
+
+
+@profiled
+def Get_Derived_Metrics(data, level="county", value_columns=("cases", "deaths"), date_column="datetime",
+                        pop_column="pop", window=7):
+    """Return the derived metrics (see Add_Derived_Metrics) for the data at level "county", "state" or "country".
+    The metrics are kept in the cache, under a key with the set of regions in the data. If the cached metrics
+    were made from the first dates of the same data, only the new dates are added with Update_Derived_Metrics.
+    If the data is different (e.g. revised counts) everything is computed again."""
+    key = Derived_Keys[level]
+    if date_column not in data.columns:
+        date_column = "date"
+    regions = np.unique(data[key].astype(str).to_numpy())
+    regions_hash = hashlib.sha1("|".join(regions).encode()).hexdigest()[:16]
+    url = "metrics:{}:{}:{}:{}".format(level, ",".join(value_columns), window, regions_hash)
+    version = Cache_Versions["metrics"]
+    metrics = Get_Cache().load("metrics_" + level, url, version)
+    if metrics is not None:
+        last_date = metrics[date_column].max()
+        old = data[date_column] <= last_date
+        if _same_rows(metrics, data.loc[old], key, value_columns, date_column):
+            new_rows = data.loc[~old]
+            if len(new_rows) == 0:
+                return metrics
+            metrics = Update_Derived_Metrics(metrics, new_rows, key, value_columns, date_column, pop_column,
+                                             window)
+        else:
+            metrics = None
+    if metrics is None:
+        metrics = Add_Derived_Metrics(data, key, value_columns, date_column, pop_column, window)
+    Get_Cache().store("metrics_" + level, url, version, metrics)
+    return metrics
+
+
+#
+# Indexed store for queries on the time series.
+#
+class CovidStore(object):
+    """Query store for a long time series (one row per region and date).
+    The rows are sorted by (region, date), so a lookup of a region, or a region and date range, is a binary
+    search instead of a scan of the whole table. A second array with the row order by date makes the
+    top-N for a date a binary search too. Optionally, name_columns (e.g. ("county", "st")) give an
+    index from the names to the region."""
+
+    def __init__(self, data, region_column, date_column="datetime", name_columns=None):
+        if date_column not in data.columns:
+            date_column = "date"
+        self.region_column = region_column
+        self.date_column = date_column
+        self.data = data.set_index([region_column, date_column]).sort_index()
+        dates = self.data.index.get_level_values(1)
+        self._date_order = np.argsort(dates.to_numpy(), kind="stable")
+        self._dates_sorted = dates.to_numpy()[self._date_order]
+        self.names = {}
+        if name_columns is not None:
+            names = self.data[list(name_columns)].copy()
+            names["region"] = self.data.index.get_level_values(0)
+            names = names.drop_duplicates(subset=list(name_columns))
+            self.names = dict(zip(map(tuple, names[list(name_columns)].astype(str).to_numpy()), names["region"]))
+        if 'this_date' in data.__dict__:
+            self.this_date = data.this_date
+
+    def region(self, *names):
+        """Return the region for the names, e.g. store.region("Strafford", "NH")."""
+        return self.names[tuple(names)]
+
+    def point(self, region, date):
+        """Return the row for the region on the date."""
+        return self.data.loc[(region, pd.Timestamp(date))]
+
+    def range(self, region, start=None, end=None):
+        """Return the rows for the region with start <= date <= end. Either can be None for an open range."""
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        return self.data.loc[(region, slice(start, end)), :]
+
+    def on_date(self, date):
+        """Return the rows for all regions on the date."""
+        date = np.datetime64(pd.Timestamp(date))
+        lo = np.searchsorted(self._dates_sorted, date, side="left")
+        hi = np.searchsorted(self._dates_sorted, date, side="right")
+        return self.data.iloc[self._date_order[lo:hi]]
+
+    def top_n(self, date, column, n=10):
+        """Return the n regions with the largest value in column on the date."""
+        return self.on_date(date).nlargest(n, column)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def Get_Store(dataset="counties"):
+    """Return the CovidStore for "counties", "states" (NYT) or "countries" (JHU, summed per country).
+    Each store is built once per process, and shared by all callers."""
+    with _stores_lock:
+        if dataset not in _stores:
+            if dataset in ("counties", "states"):
+                data_states, data_counties = Get_NYT_USA_Data()
+                _stores["states"] = CovidStore(data_states, "fips", name_columns=("state",))
+                _stores["counties"] = CovidStore(data_counties, "fips", name_columns=("county", "st"))
+            elif dataset == "countries":
+                sums = Sum_data(*Get_Global_data(), None)
+                long = [JHU_To_Long(s, name).drop(columns=["date"]) for s, name in
+                        zip(sums, ("cases", "deaths", "recovered"))]
+                data = long[0].merge(long[1], on=["code", "datetime"], how="outer")
+                data = data.merge(long[2], on=["code", "datetime"], how="outer")
+                data.this_date = sums[0].this_date
+                _stores["countries"] = CovidStore(data, "code")
+            else:
+                raise ValueError("Unknown dataset {}, use counties, states or countries.".format(dataset))
+        return _stores[dataset]
+
+
+#
+# Rollup cube: the US counts summed at every level of the census hierarchy, county -> state -> census
+# division -> census region -> nation, for every date. After the cube is built, the numbers for a level
+# are a lookup in an array, instead of a new groupby of the county table.
+#
+Rollup_Levels = ("county", "state", "division", "region", "nation")
+
+Census_Region_Names = {0: "Unknown", 1: "Northeast", 2: "Midwest", 3: "South", 4: "West", 5: "Territories"}
+Census_Division_Names = {1: "New England", 2: "Middle Atlantic", 3: "East North Central", 4: "West North Central",
+                         5: "South Atlantic", 6: "East South Central", 7: "West South Central", 8: "Mountain",
+                         9: "Pacific"}
+
+
+def _sum_rows(array, parent, n_parent):
+    """Return the sums of the rows of array that have the same parent index, as an (n_parent, columns) array."""
+    out = np.zeros((n_parent, array.shape[1]), dtype=array.dtype)
+    if len(parent) == 0:
+        return out
+    order = np.argsort(parent, kind="stable")
+    sorted_parent = parent[order]
+    starts = np.flatnonzero(np.r_[True, sorted_parent[1:] != sorted_parent[:-1]])
+    out[sorted_parent[starts]] = np.add.reduceat(array[order], starts, axis=0)
+    return out
+
+
+def _rollup_block(county_index, date_index, values, n_counties, n_dates, parents):
+    """Return, for each column of values, a list with the (regions, n_dates) array of each level.
+    The county array is filled with a single bincount, every next level is summed from the level below it.
+    This is a plain function of arrays, so it can run in a worker process."""
+    flat = county_index.astype(np.int64)*n_dates + date_index
+    out = []
+    for j in range(values.shape[1]):
+        counts = np.bincount(flat, weights=values[:, j], minlength=n_counties*n_dates)
+        arrays = [np.rint(counts).astype(np.int64).reshape(n_counties, n_dates)]
+        for parent, n_parent in parents:
+            arrays.append(_sum_rows(arrays[-1], parent, n_parent))
+        out.append(arrays)
+    return out
+
+
+class RollupCube(object):
+    """The NYT county counts summed at every level of Rollup_Levels, for every date.
+    The hierarchy comes from the REGION, DIVISION and STATE of the census table (Get_Census_Data()).
+    The keys are the fips string for a county, the state fips number for a state, 10*REGION + DIVISION for a
+    division (so the territories, REGION 5, do not mix with the census divisions), REGION for a region, and
+    "US" for the nation. The counts are in self.values[column][level], an array with a row for each key in
+    self.keys[level] and a column for each date in self.dates.
+    The cube is built in one pass over the rows. With processes=N the dates are split in blocks of block_days,
+    which are summed in N worker processes. New dates are added with append()."""
+
+    def __init__(self, data_counties, census=None, value_columns=("cases", "deaths"), date_column="datetime",
+                 processes=None, block_days=64):
+        if census is None:
+            census = Get_Census_Data()
+        if date_column not in data_counties.columns:
+            date_column = "date"
+        self.value_columns = tuple(value_columns)
+        self.date_column = date_column
+        states = census.loc[census["COUNTY"] == 0]
+        self._state_info = pd.DataFrame({"REGION": states["REGION"].astype(int).to_numpy(),
+                                         "DIVISION": states["DIVISION"].astype(int).to_numpy(),
+                                         "name": states["STNAME"].astype(str).to_numpy(),
+                                         "pop": states["POPESTIMATE2019"].astype(np.int64).to_numpy()},
+                                        index=states["STATE"].astype(int).to_numpy())
+        counties = census.loc[census["COUNTY"] != 0]
+        self._county_pop = pd.Series(counties["POPESTIMATE2019"].astype(np.int64).to_numpy(),
+                                     index=counties["fips"].astype(str).to_numpy())
+
+        self.dates = pd.DatetimeIndex([])
+        self.keys = {}
+        self.names = {}
+        self.pop = {}
+        self._parents = []
+        self.values = {col: {} for col in self.value_columns}
+        self.unassigned = 0
+        self._set_keys(pd.Index([], dtype=object))
+        self.append(data_counties, processes, block_days)
+        if 'this_date' in data_counties.__dict__:
+            self.this_date = data_counties.this_date
+
+    def _set_keys(self, county_keys):
+        """Set the keys of all levels from the county keys, and move the counts already in the cube to the
+        rows of the new keys."""
+        county_keys = pd.Index(county_keys).sort_values()
+        state = county_keys.astype(int) // 1000 if len(county_keys) else pd.Index([], dtype=int)
+        info = self._state_info.reindex(np.unique(state))
+        region = info["REGION"].fillna(0).astype(int)
+        division = 10*region + info["DIVISION"].fillna(0).astype(int)
+        keys = {"county": county_keys,
+                "state": pd.Index(info.index),
+                "division": pd.Index(np.unique(division)),
+                "region": pd.Index(np.unique(region)),
+                "nation": pd.Index(["US"] if len(county_keys) else [], dtype=object)}
+        division_of_region = pd.Series(keys["division"] // 10, index=keys["division"])
+
+        # The index in the next level up, for each key of a level.
+        self._parents = [(keys["state"].get_indexer(state), len(keys["state"])),
+                         (keys["division"].get_indexer(division), len(keys["division"])),
+                         (keys["region"].get_indexer(division_of_region.to_numpy()), len(keys["region"])),
+                         (np.zeros(len(keys["region"]), dtype=np.intp), len(keys["nation"]))]
+
+        self.names = {"county": pd.Series(county_keys, index=county_keys),
+                      "state": info["name"].fillna("Unknown"),
+                      "division": pd.Series([Census_Division_Names.get(d % 10, "Unknown") if d // 10 in range(1, 5)
+                                             else "{} {}".format(Census_Region_Names.get(d // 10, "Unknown"), d % 10)
+                                             for d in keys["division"]], index=keys["division"]),
+                      "region": pd.Series([Census_Region_Names.get(r, "Unknown") for r in keys["region"]],
+                                          index=keys["region"]),
+                      "nation": pd.Series(["United States"]*len(keys["nation"]), index=keys["nation"])}
+        pop = {"county": self._county_pop.reindex(county_keys),
+               "state": info["pop"]}
+        for level, (parent, n_parent), below in zip(Rollup_Levels[2:], self._parents[1:], Rollup_Levels[1:]):
+            total = np.bincount(parent, weights=pop[below].fillna(0).to_numpy(), minlength=n_parent)
+            pop[level] = pd.Series(np.rint(total).astype(np.int64), index=keys[level])
+        self.pop = pop
+
+        for col in self.value_columns:
+            for level in Rollup_Levels:
+                new = np.zeros((len(keys[level]), len(self.dates)), dtype=np.int64)
+                if level in self.keys and len(self.keys[level]):
+                    new[keys[level].get_indexer(self.keys[level])] = self.values[col][level]
+                self.values[col][level] = new
+        self.keys = keys
+
+    def append(self, new_rows, processes=None, block_days=64):
+        """Add the county rows in new_rows to the cube. A date in new_rows replaces that date in the cube, so
+        new_rows must have all the counties for each of its dates, as the NYT files do. Rows without a fips are
+        not in any level, their number is kept in self.unassigned."""
+        rows = new_rows.loc[new_rows["fips"].astype(str) != ""]
+        self.unassigned += len(new_rows) - len(rows)
+        fips = rows["fips"].astype(str).str.zfill(5)
+        dates = pd.DatetimeIndex(pd.to_datetime(rows[self.date_column]))
+
+        new_counties = pd.Index(fips.unique()).difference(self.keys["county"])
+        if len(new_counties):
+            self._set_keys(self.keys["county"].append(new_counties))
+        new_dates = dates.unique().sort_values()
+        all_dates = self.dates.union(new_dates)
+        if len(all_dates) > len(self.dates):
+            where = all_dates.get_indexer(self.dates)
+            for col in self.value_columns:
+                for level in Rollup_Levels:
+                    new = np.zeros((len(self.keys[level]), len(all_dates)), dtype=np.int64)
+                    new[:, where] = self.values[col][level]
+                    self.values[col][level] = new
+            self.dates = all_dates
+
+        county_index = self.keys["county"].get_indexer(fips)
+        date_index = new_dates.get_indexer(dates)
+        values = np.column_stack([pd.to_numeric(rows[col], errors="coerce").fillna(0).to_numpy(np.float64)
+                                  for col in self.value_columns])
+        n_counties = len(self.keys["county"])
+        blocks = [(start, min(start + block_days, len(new_dates))) for start in range(0, len(new_dates), block_days)]
+        with Profile_Stage("rollup", rows=len(rows)):
+            if processes and len(blocks) > 1:
+                with ProcessPoolExecutor(max_workers=processes) as pool:
+                    futures = []
+                    for start, end in blocks:
+                        mask = (date_index >= start) & (date_index < end)
+                        futures.append(pool.submit(_rollup_block, county_index[mask], date_index[mask] - start,
+                                                   values[mask], n_counties, end - start, self._parents))
+                    parts = [f.result() for f in futures]
+                result = [[np.concatenate([p[j][k] for p in parts], axis=1) for k in range(len(Rollup_Levels))]
+                          for j in range(len(self.value_columns))]
+            else:
+                result = _rollup_block(county_index, date_index, values, n_counties, len(new_dates), self._parents)
+
+        where = self.dates.get_indexer(new_dates)
+        for col, arrays in zip(self.value_columns, result):
+            for level, array in zip(Rollup_Levels, arrays):
+                self.values[col][level][:, where] = array
+        if 'this_date' in new_rows.__dict__:
+            self.this_date = new_rows.this_date
+        return self
+
+    def level(self, level, column="cases"):
+        """Return the counts in column for all keys of the level, with a column for each date."""
+        return pd.DataFrame(self.values[column][level], index=self.keys[level], columns=self.dates)
+
+    def series(self, level, key, column="cases"):
+        """Return the counts in column for one key of the level, for all dates."""
+        return pd.Series(self.values[column][level][self.keys[level].get_loc(key)], index=self.dates, name=key)
+
+    def on_date(self, level, date):
+        """Return a table with the name, population and counts for all keys of the level on the date."""
+        i = self.dates.get_loc(pd.Timestamp(date))
+        out = pd.DataFrame({"name": self.names[level], "pop": self.pop[level]}, index=self.keys[level])
+        for col in self.value_columns:
+            out[col] = self.values[col][level][:, i]
+        return out
+
+    def long(self, level):
+        """Return the level as a long frame, with one row per key and date, with the columns key, name, datetime,
+        the counts and pop, which can go into Add_Derived_Metrics(cube.long("state"), "key")."""
+        n_keys, n_dates = len(self.keys[level]), len(self.dates)
+        out = pd.DataFrame({"key": np.repeat(self.keys[level].to_numpy(), n_dates),
+                            "name": np.repeat(self.names[level].to_numpy(), n_dates),
+                            "datetime": np.tile(self.dates.to_numpy(), n_keys)})
+        for col in self.value_columns:
+            out[col] = self.values[col][level].ravel()
+        out["pop"] = np.repeat(self.pop[level].to_numpy(), n_dates)
+        return out
+
+
+@profiled
+def Get_Rollup_Cube(processes=None):
+    """Return the RollupCube of the NYT county data. It is built once per process, and shared by all callers."""
+    with _stores_lock:
+        if "rollup" not in _stores:
+            data_states, data_counties = Get_NYT_USA_Data()
+            _stores["rollup"] = RollupCube(data_counties, processes=processes)
+        return _stores["rollup"]
+
+
+#
+# Hover text and per date arrays for choropleth maps and animations.
+#
+def _count_text(column):
+    """Return the column as strings of integers, with 'n/a' for missing values."""
+    return pd.to_numeric(column, errors="coerce").astype("Int64").astype(str).replace("<NA>", "n/a")
+
+
+def Hover_Text(data):
+    """Return a Series with the hover text for each row of the NYT states or counties data, built with
+    column wise string operations. Counties get "county, st", states get "state", followed by
+    the population, cases and deaths."""
+    if "county" in data.columns:
+        name = data["county"].astype(str) + ", " + data["st"].astype(str)
+    else:
+        name = data["state"].astype(str)
+    return (name + "<br>pop:" + _count_text(data["pop"]) + "<br>cases:" + _count_text(data["cases"]) +
+            " deaths:" + _count_text(data["deaths"]))
+
+
+class ChoroplethFrames(object):
+    """Build the arrays for a choropleth map of the NYT data, one date at a time.
+    The arrays are in the order of the features in the GeoJSON (by default from Get_County_GEO()), so they
+    can be given to plotly directly. The data is sorted by date once, and the position of each row in the
+    feature order is computed once, so a frame is an array slice. The hover text is made only for the
+    dates that are asked for, and the most recent max_cached frames are kept."""
+
+    def __init__(self, data, geo=None, value_column="cases", id_column="fips", max_cached=64):
+        if geo is None:
+            geo = Get_County_GEO()
+        self.feature_ids = np.array([f["id"] for f in geo["features"]])
+        self.value_column = value_column
+        self.max_cached = max_cached
+        self._cache = {}
+        date_column = "datetime" if "datetime" in data.columns else "date"
+        order = np.argsort(pd.to_datetime(data[date_column]).to_numpy(), kind="stable")
+        self.data = data.iloc[order].reset_index(drop=True)
+        dates = pd.to_datetime(self.data[date_column]).to_numpy()
+        self.dates, self._starts = np.unique(dates, return_index=True)
+        self._ends = np.append(self._starts[1:], len(dates))
+        # Position of each row in the feature order, -1 if the row has no feature (e.g. "Unknown" counties)
+        ids = pd.to_numeric(self.data[id_column], errors="coerce").astype("Int64").astype(str).str.zfill(5)
+        if len(self.feature_ids) and len(self.feature_ids[0]) != 5:
+            ids = ids.str[-len(self.feature_ids[0]):]
+        self._position = pd.Index(self.feature_ids).get_indexer(ids)
+        # The values as floats, converted once, so a frame only takes a slice.
+        self._values = self.data[self.value_column].to_numpy(dtype=np.float64)
+
+    def frame(self, date):
+        """Return a dictionary with the 'date', and the 'values', 'fips' and 'text' arrays in feature order."""
+        date = np.datetime64(pd.Timestamp(date))
+        if date in self._cache:
+            return self._cache[date]
+        i = np.searchsorted(self.dates, date)
+        if i >= len(self.dates) or self.dates[i] != date:
+            raise KeyError("No data for date {}".format(date))
+        rows = slice(self._starts[i], self._ends[i])
+        position = self._position[rows]
+        good = position >= 0
+        values = np.full(len(self.feature_ids), np.nan)
+        values[position[good]] = self._values[rows][good]
+        text = np.full(len(self.feature_ids), "", dtype=object)
+        text[position[good]] = Hover_Text(self.data.iloc[rows]).to_numpy()[good]
+        out = {"date": date, "values": values, "fips": self.feature_ids, "text": text}
+        if len(self._cache) >= self.max_cached:
+            self._cache.pop(next(iter(self._cache)))   # Remove the oldest frame.
+        self._cache[date] = out
+        return out
+
+    def frames(self, start=None, end=None):
+        """Generator for the frames of all dates with start <= date <= end."""
+        lo = 0 if start is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start)), side="left")
+        hi = len(self.dates) if end is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end)),
+                                                                 side="right")
+        for date in self.dates[lo:hi]:
+            yield self.frame(date)
+
+
+#
+# Compact, indexed storage of the county shapes.
+#
+class CountyGeometry(object):
+    """The county shapes from the GeoJSON, stored in a few numpy arrays instead of nested Python lists.
+    All the points are in one (n, 2) array. ring_offsets[i]:ring_offsets[i+1] are the points of ring i,
+    polygon_offsets gives the rings of each polygon and feature_offsets the polygons of each feature (county).
+    The features are indexed by fips and by state (the first two digits of the fips).
+    Simplified versions of the shapes are made for each tolerance (in degrees) in resolutions."""
+
+    resolutions = {"full": 0., "medium": 0.01, "low": 0.05}
+
+    def __init__(self, geo):
+        points = []
+        ring_sizes = []
+        polygon_sizes = []
+        feature_sizes = []
+        self.fips = []
+        self.properties = []
+        self.multi = []
+        for feature in geo["features"]:
+            geometry = feature["geometry"]
+            polygons = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+            self.multi.append(geometry["type"] == "MultiPolygon")
+            self.fips.append(feature["id"])
+            self.properties.append(feature.get("properties", {}))
+            feature_sizes.append(len(polygons))
+            for polygon in polygons:
+                polygon_sizes.append(len(polygon))
+                for ring in polygon:
+                    ring_sizes.append(len(ring))
+                    points.extend(ring)
+        self.points = np.array(points, dtype=np.float64).reshape(-1, 2)
+        self.ring_offsets = np.concatenate([[0], np.cumsum(ring_sizes)]).astype(np.int64)
+        self.polygon_offsets = np.concatenate([[0], np.cumsum(polygon_sizes)]).astype(np.int64)
+        self.feature_offsets = np.concatenate([[0], np.cumsum(feature_sizes)]).astype(np.int64)
+        self.fips = np.array(self.fips)
+        self.by_fips = {f: i for i, f in enumerate(self.fips)}
+        states = np.array([f[:2] for f in self.fips])
+        self.by_state = {st: np.nonzero(states == st)[0] for st in np.unique(states)}
+        self.simplified = {"full": (self.points, self.ring_offsets)}
+        for name, tolerance in self.resolutions.items():
+            if tolerance > 0:
+                self.simplified[name] = self.simplify(tolerance)
+
+    def simplify(self, tolerance):
+        """Return (points, ring_offsets) with the rings simplified by snapping the points to a grid of
+        size tolerance, and keeping only the first point in each grid cell along the ring.
+        Rings that would get fewer than 4 points are kept whole."""
+        ring_sizes = np.diff(self.ring_offsets)
+        ring_of_point = np.repeat(np.arange(len(ring_sizes)), ring_sizes)
+        cell = np.floor(self.points/tolerance).astype(np.int64)
+        keep = np.ones(len(self.points), dtype=bool)
+        keep[1:] = np.any(cell[1:] != cell[:-1], axis=1) | (ring_of_point[1:] != ring_of_point[:-1])
+        # Always keep the first and the last (closing) point of each ring.
+        keep[self.ring_offsets[:-1]] = True
+        keep[self.ring_offsets[1:] - 1] = True
+        kept = np.add.reduceat(keep, self.ring_offsets[:-1]) if len(keep) else np.zeros(0, dtype=np.int64)
+        small = kept < 4
+        keep |= small[ring_of_point]
+        kept = np.where(small, ring_sizes, kept)
+        return self.points[keep], np.concatenate([[0], np.cumsum(kept)]).astype(np.int64)
+
+    def select(self, fips=None, state=None):
+        """Return the indexes of the features for a list of fips codes, or for a state (2 digit fips code)."""
+        if fips is not None:
+            return np.array([self.by_fips[f] for f in fips if f in self.by_fips], dtype=np.int64)
+        if state is not None:
+            return self.by_state.get("{:02d}".format(int(state)), np.zeros(0, dtype=np.int64))
+        return np.arange(len(self.fips))
+
+    def geojson(self, fips=None, state=None, resolution="full"):
+        """Return a GeoJSON FeatureCollection for the selected features (see select()), at the resolution."""
+        points, ring_offsets = self.simplified[resolution]
+        features = []
+        for i in self.select(fips, state):
+            polygons = []
+            for p in range(self.feature_offsets[i], self.feature_offsets[i + 1]):
+                rings = []
+                for r in range(self.polygon_offsets[p], self.polygon_offsets[p + 1]):
+                    rings.append(points[ring_offsets[r]:ring_offsets[r + 1]].tolist())
+                polygons.append(rings)
+            geometry = {"type": "MultiPolygon", "coordinates": polygons} if self.multi[i] else \
+                {"type": "Polygon", "coordinates": polygons[0]}
+            features.append({"type": "Feature", "id": self.fips[i], "properties": self.properties[i],
+                             "geometry": geometry})
+        return {"type": "FeatureCollection", "features": features}
+
+
+@profiled
+def Get_County_Geometry(from_web=None):
+    """Return the CountyGeometry for the county shapes. The parsed and simplified arrays are cached,
+    so after the first call this is a single load of a few arrays."""
+
+    def build():
+        return CountyGeometry(_json_loads(Fetch_URL(Source_URLs["county_geo"])))
+
+    return Get_Cache().fetch("county_geometry", Source_URLs["county_geo"], build, Cache_Versions["county_geometry"],
+                             Cache_TTL["county_geometry"], from_web)
+
+
+#
+# Command line: refresh all the sources in the cache, e.g. from cron, so the notebooks find fresh data.
+#
+Sync_Sources = {
+    "abbrevs": lambda from_web: Get_Abbrevs(from_web),
+    "census": lambda from_web: Get_Census_Data(from_web),
+    "country_codes": lambda from_web: Get_Country_Codes(from_web),
+    "world_pop": lambda from_web: Get_World_Pop_Data(from_web),
+    "jhu_global": lambda from_web: Get_Global_data(from_web=from_web),
+    "nyt": lambda from_web: (Sync_NYT_Data("states", from_web=from_web),
+                             Sync_NYT_Data("counties", from_web=from_web)),
+    "county_geo": lambda from_web: Get_County_GEO(force_web=from_web is True),
+    "county_geometry": lambda from_web: Get_County_Geometry(from_web),
+}
+
+
+def _result_rows(result):
+    """Return the number of rows in a loader result, which is a frame, a dictionary, a CountyGeometry (the
+    number of counties) or a tuple of those."""
+    if isinstance(result, (tuple, list)):
+        return sum(_result_rows(r) for r in result)
+    if isinstance(result, CountyGeometry):
+        return len(result.fips)
+    if hasattr(result, "shape"):
+        return result.shape[0]
+    if isinstance(result, dict):
+        return len(result.get("features", result))
+    return 0
+
+
+def Sync_All(sources=None, from_web=None):
+    """Load each of the sources (default all of Sync_Sources) into the cache, and return a list with a
+    dictionary for each: the source, the status ("downloaded", "cached" or "failed"), the time it took,
+    the rows and the error, if any. A failure of one source does not stop the others."""
+    if sources is None:
+        sources = list(Sync_Sources)
+    summary = []
+    for source in sources:
+        misses = Cache_Stats()["misses"]
+        start = time.perf_counter()
+        status = {"source": source, "rows": 0, "error": None}
+        try:
+            status["rows"] = _result_rows(Sync_Sources[source](from_web))
+            status["status"] = "downloaded" if Cache_Stats()["misses"] > misses else "cached"
+        except Exception as error:
+            status["status"] = "failed"
+            status["error"] = "{}: {}".format(type(error).__name__, error)
+        status["seconds"] = time.perf_counter() - start
+        summary.append(status)
+    return summary
+
+
+def main(argv=None):
+    """Command line entry point. Return the exit status: 0 if all sources were synced, 1 otherwise."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Tools for the COVID19 data cache.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sync = commands.add_parser("sync", help="Refresh the sources in the cache, and print a summary.")
+    sync.add_argument("--source", action="append", choices=list(Sync_Sources),
+                      help="Only sync this source, can be repeated. Default is all sources.")
+    sync.add_argument("--force", action="store_true", help="Download every source, even if the cached copy is fresh.")
+    sync.add_argument("--cache-dir", default=None, help="The cache directory, default is $COVID19_CACHE_DIR "
+                                                        "or covid19_cache.")
+    sync.add_argument("--format", default=None, choices=Frame_Formats, help="Storage format of the cache.")
+    sync.add_argument("--json", action="store_true", help="Print the summary as json.")
+    args = parser.parse_args(argv)
+
+    if args.cache_dir is not None or args.format is not None:
+        Set_Cache(args.cache_dir, fmt=args.format)
+    summary = Sync_All(args.source, True if args.force else None)
+    failed = [s for s in summary if s["status"] == "failed"]
+
+    if args.json:
+        print(json.dumps({"cache_dir": Get_Cache().cache_dir, "time": time.time(), "sources": summary}))
+    else:
+        for s in summary:
+            print("{source:16s} {status:10s} {seconds:8.2f}s {rows:10d} rows  {error}".format(
+                **dict(s, error=s["error"] or "")))
+        print("{} of {} sources synced to {}".format(len(summary) - len(failed), len(summary),
+                                                     Get_Cache().cache_dir))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    # Run main() from the imported module, not from __main__, so the classes in the objects that are
+    # pickled to the cache (e.g. CountyGeometry) are found again when a notebook imports this module.
+    import Get_Covid19_data
+    sys.exit(Get_Covid19_data.main())
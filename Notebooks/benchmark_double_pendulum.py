@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+# Benchmarks of the integrators for the double pendulum in double_pendulum.py.
+#
+# Each integrator runs the same pendulum (or ensemble of pendulums) for a number of run lengths, and we record:
+#   seconds    - the wall time of the run (the best of --repeat runs),
+#   steps_per_s - the number of output steps, times the number of pendulums, per second,
+#   rhs_evals  - the evaluations of the right hand side (and jac_evals, of the Jacobian),
+#   peak_mb    - the peak memory allocated during the run (from tracemalloc, in a separate run),
+#   energy_error - the largest change of the total energy during the run, relative to the depth of the potential.
+#
+# The results are printed as a table, and can be written as CSV and/or JSON to track regressions.
+# With --check-export a short movie is written with ani.save() and with the parallel render_movie(), and the
+# decoded frames are compared. That needs matplotlib and ffmpeg, and is skipped when ffmpeg is not found.
+#
+# Usage:
+#   python benchmark_double_pendulum.py --lengths 10 60 --sizes 1 100 1000 --csv bench.csv --json bench.json
+#
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy.integrate as integrate
+
+import double_pendulum as dp
+
+parameters = (1.0, 1.1, 0.47, 0.5, 9.8)            # L1, M1, L2, M2, G as in double_pendulum.main()
+start_state = np.radians([80.0, 0.0, -25.0, 0.0])
+
+
+def energy_error(states, params=parameters):
+    """Return the largest energy change along the (steps,4) or (steps,N,4) states, relative to the potential depth."""
+    l1, m1, l2, m2, g = params
+    energy = dp.double_pendulum_energy(states, params)
+    return float(np.abs(energy - energy[0]).max()/((m1+m2)*g*l1 + m2*g*l2))
+
+
+def ensemble_states(n, spread=1.e-3, seed=1):
+    """Return n start states close to start_state, as for a chaos study."""
+    rng = np.random.default_rng(seed)
+    return start_state + spread*rng.standard_normal((n, 4))
+
+#
+# The integrators. Each takes the (N,4) start states and the output times t, and returns the states at the
+# times t, shape (len(t),N,4), and a dictionary with the counts of function and Jacobian evaluations.
+#
+def run_odeint(backend, jacobian=False, rtol=None, atol=None):
+    def run(states, t):
+        out = np.empty((len(t),) + states.shape)
+        nfe = nje = 0
+        for k, state in enumerate(states):
+            result, info = dp.integrate_pendulum(state, t, parameters, backend, jacobian, rtol, atol, full_output=True)
+            out[:, k] = result
+            nfe += int(info["nfe"][-1])
+            nje += int(info["nje"][-1])
+        return out, {"rhs_evals": nfe, "jac_evals": nje}
+    return run
+
+
+def run_solve_ivp(method, jacobian=False, rtol=1.e-6, atol=1.e-9):
+    rhs, jac = dp.pendulum_backend("python")
+    def run(states, t):
+        out = np.empty((len(t),) + states.shape)
+        # The calls are counted here, because sol.nfev leaves out those for an estimated Jacobian.
+        calls = [0]
+        def fun(tt, y):
+            calls[0] += 1
+            return rhs(y, tt, *parameters)
+        njev = 0
+        for k, state in enumerate(states):
+            sol = integrate.solve_ivp(fun, (t[0], t[-1]), state, method=method, t_eval=t, rtol=rtol, atol=atol,
+                                      jac=(lambda tt, y: jac(y, tt, *parameters)) if jacobian else None)
+            out[:, k] = sol.y.T
+            njev += int(sol.njev)
+        return out, {"rhs_evals": calls[0], "jac_evals": njev}
+    return run
+
+
+def run_ensemble_odeint(rtol=None, atol=None):
+    def run(states, t):
+        result, info = dp.integrate_ensemble(states, t, parameters, method="odeint", rtol=rtol, atol=atol,
+                                             full_output=True)
+        return result, {"rhs_evals": int(info["nfe"][-1]), "jac_evals": 0}
+    return run
+
+
+def run_engine(method):
+    def run(states, t):
+        engine = dp.PendulumEngine(parameters, t[1] - t[0], method)
+        result = engine.run(states, len(t) - 1)
+        return result["states"], {"rhs_evals": engine.rhs_evals, "jac_evals": 0}
+    return run
+
+
+def integrators():
+    """Return a list of (name, run, ensemble), where ensemble is True if run integrates all pendulums at once,
+    and False if it loops over them (then only the small ensembles are run)."""
+    out = []
+    backends = ["numpy", "python"] + (["numba"] if dp.has_numba else [])
+    for backend in backends:
+        out.append(("odeint/" + backend, run_odeint(backend), False))
+    for method in ("RK45", "DOP853", "LSODA"):
+        out.append(("solve_ivp/" + method, run_solve_ivp(method), False))
+    # odeint only uses a Jacobian in its stiff mode, which the pendulum never needs, so the analytic Jacobian
+    # is compared on the stiff methods of solve_ivp, which always use one.
+    for method in ("Radau", "BDF"):
+        out.append(("solve_ivp/" + method, run_solve_ivp(method), False))
+        out.append(("solve_ivp/" + method + "+jac", run_solve_ivp(method, jacobian=True), False))
+    out.append(("odeint/ensemble", run_ensemble_odeint(), True))
+    out.append(("engine/rk4", run_engine("rk4"), True))
+    out.append(("engine/midpoint", run_engine("midpoint"), True))
+    return out
+
+
+def benchmark(name, run, n, length, dt=0.01, repeat=3, memory=True):
+    """Run the integrator for n pendulums over length seconds, and return a dictionary with the results."""
+    states = ensemble_states(n) if n > 1 else start_state.reshape(1, 4)
+    t = np.arange(0.0, length + dt/2, dt)
+    best = np.inf
+    for i in range(repeat):
+        start = time.perf_counter()
+        result, counts = run(states, t)
+        best = min(best, time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        run(states, t)
+        peak_mb = tracemalloc.get_traced_memory()[1]/1024**2
+        tracemalloc.stop()
+    steps = (len(t) - 1)*n
+    return {"integrator": name, "pendulums": n, "length_s": length, "dt": dt, "steps": steps, "seconds": best,
+            "steps_per_s": steps/best, "rhs_evals": counts["rhs_evals"], "jac_evals": counts["jac_evals"],
+            "peak_mb": peak_mb, "energy_error": energy_error(result)}
+
+
+def _decode_movie(filename):
+    """Return the frames of the movie filename as an (n, bytes per frame) array of RGB values, decoded by ffmpeg."""
+    import matplotlib
+    command = [matplotlib.rcParams["animation.ffmpeg_path"], "-v", "error", "-i", filename,
+               "-f", "rawvideo", "-pix_fmt", "rgb24"]
+    first = subprocess.run(command + ["-frames:v", "1", "-"], capture_output=True, check=True).stdout
+    frames = subprocess.run(command + ["-"], capture_output=True, check=True).stdout
+    return np.frombuffer(frames, dtype=np.uint8).reshape(-1, len(first))
+
+
+def check_movie_export(frames=60, chunk_frames=10, processes=2, figsize=(3,2.5), dt=0.01):
+    """Write a short movie with ani.save() and with render_movie(), in chunks of chunk_frames on processes
+    processes, decode both with ffmpeg and return the number of frames that differ.
+    Return None when ffmpeg is not installed."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+    if shutil.which(matplotlib.rcParams["animation.ffmpeg_path"]) is None:
+        return None
+    l1, m1, l2, m2, g = parameters
+    t = np.arange(0., (frames + 1)*dt, dt)[:frames + 1]
+    result = integrate.odeint(dp.double_pendulum_step, np.radians([80., 0., -25., 0.]), t, args=(parameters,))
+    x1 = l1*np.sin(result[:, 0])
+    y1 = -l1*np.cos(result[:, 0])
+    x2 = l2*np.sin(result[:, 2]) + x1
+    y2 = -l2*np.cos(result[:, 2]) + y1
+
+    with tempfile.TemporaryDirectory() as directory:
+        serial = os.path.join(directory, "serial.mp4")
+        parallel = os.path.join(directory, "parallel.mp4")
+        fig = plt.figure(figsize=figsize)
+        artists = dp.setup_pendulum_figure(fig, l1, l2)
+        ani = animation.FuncAnimation(fig, lambda i: dp.draw_pendulum_frame(artists, i, x1, y1, x2, y2, dt),
+                                      np.arange(1, len(x1)), blit=True)
+        ani.save(filename=serial, fps=60)
+        plt.close(fig)
+        dp.render_movie(parallel, x1, y1, x2, y2, l1, l2, dt, fps=60, processes=processes,
+                        chunk_frames=chunk_frames, figsize=figsize)
+        first, second = _decode_movie(serial), _decode_movie(parallel)
+    if first.shape != second.shape:
+        return max(len(first), len(second))
+    return int(np.any(first != second, axis=1).sum())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the double pendulum integrators.")
+    parser.add_argument("--lengths", type=float, nargs="+", default=[10., 60.], help="Run lengths in seconds.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 1000], help="Numbers of pendulums.")
+    parser.add_argument("--loop-limit", type=int, default=100,
+                        help="Largest number of pendulums for the integrators that loop over the pendulums.")
+    parser.add_argument("--dt", type=float, default=0.01, help="Output (and fixed) step size in seconds.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs to take the best time of.")
+    parser.add_argument("--only", nargs="+", default=None, help="Only run integrators whose name contains one "
+                                                               "of these, e.g. odeint engine/rk4")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the (slow) peak memory runs.")
+    parser.add_argument("--csv", default=None, help="Write the results to this CSV file.")
+    parser.add_argument("--json", default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--check-export", action="store_true",
+                        help="Only check that render_movie() writes the same frames as ani.save().")
+    args = parser.parse_args(argv)
+
+    if args.check_export:
+        differ = check_movie_export()
+        if differ is None:
+            print("Skipped the export check: ffmpeg was not found.")
+        elif differ:
+            raise SystemExit("render_movie() and ani.save() differ in {} frames.".format(differ))
+        else:
+            print("render_movie() and ani.save() wrote the same frames.")
+        return
+
+    results = []
+    for name, run, ensemble in integrators():
+        if args.only and not any(o in name for o in args.only):
+            continue
+        for n in args.sizes:
+            if not ensemble and n > args.loop_limit:
+                continue
+            for length in args.lengths:
+                results.append(benchmark(name, run, n, length, args.dt, args.repeat, not args.no_memory))
+                print("{integrator:24s} N={pendulums:<6d} {length_s:6.1f}s {steps_per_s:12.0f} steps/s".format(
+                      **results[-1]))
+
+    table = pd.DataFrame(results)
+    with pd.option_context("display.width", 200, "display.max_columns", 20, "display.float_format", "{:.4g}".format):
+        print(table.to_string(index=False))
+    if args.csv:
+        table.to_csv(args.csv, index=False)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"host": platform.node(), "time": time.time(), "numpy": np.__version__,
+                       "numba": dp.has_numba, "results": results}, output, indent=1)
+
+
+if __name__ == "__main__":
+    main()
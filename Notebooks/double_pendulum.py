@@ -7,6 +7,9 @@
 #
 # To run this, just type "python double_pendulum.py"
 #
+# The module can also be imported, e.g. by benchmark_double_pendulum.py: the import has no side effects,
+# matplotlib is only loaded when something is drawn, and all the script code is in main().
+#
 # To get the Notebook version, with complete documentation, go here:
 # https://github.com/mholtrop/Phys601/blob/master/Notebooks/Double_Pendulum.ipynb
 #
@@ -18,11 +21,21 @@ Author: Maurik Holtrop @ UNH
 This code will integrate the equations for the double pendulum.
 The output is an animated pendumum and graphs of the phase diagrams.
 """
+import math
+import time
+import queue
+import threading
+import collections
+import itertools
+import io
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import importlib.util
 import numpy as np
-import matplotlib.pyplot as plt
 import scipy.integrate as integrate
-import matplotlib.animation as animation
-from IPython.display import HTML
+# numba is optional, for the compiled right hand side, see pendulum_backend(). It is only imported when used.
+has_numba = importlib.util.find_spec("numba") is not None
 #
 # This function defines a time step t, for a double pendulum.
 #
@@ -62,146 +75,930 @@ def double_pendulum_step(invars,t,params):
     return(out)
 
 #
-# Setup the constants for the problem.
+# The same equations for a whole ensemble of pendulums at once.
+# The states are an (N,4) array, one row per pendulum, and each of the parameters can be a single number
+# or an array with one value per pendulum. The "if" tests of double_pendulum_step become masks, so
+# there is no Python code per pendulum, and the time for a step grows with N only through numpy.
 #
-save_output = True  # Set to True to save the output to file.
-G = 9.8  # acceleration due to gravity, in m/s^2
-L1 = 1.0  # length of pendulum 1 in m
-M1 = 1.1  # mass of pendulum 1 in kg
-L2 = 0.47  # length of pendulum 2 in m
-M2 = 0.5  # mass of pendulum 2 in kg
-parameters = (L1,M1,L2,M2,G)
-# theta1_0 and theta2_0 are the initial angles (degrees)
-# omega1_0 and omega2_0 are the initial angular velocities (degrees per second)
-theta1_0 = 80.0
-omega1_0 = 0.0
-theta2_0 = -25.0
-omega2_0 = 0.0
-
-# Define the Initial State of the problem.
-state = np.radians([theta1_0,omega1_0,theta2_0,omega2_0])
-
-# create a time array from 0..60 seconds, sampled at dt second steps
-# Making the step size too small increases computational time, but makes the solution more accurate.
-Max_time = 60
-dt = 0.01
-t = np.arange(0.0, Max_time, dt)
-
-#
-# For clarity of coding, define the indexes.
-#
-i_theta1 = 0
-i_omega1 = 1
-i_theta2 = 2
-i_omega2 = 3
-
-# We integrate the ODE using scipy.integrate. This does the computational heavy lifting for us.
-result_t = integrate.odeint(double_pendulum_step, state, t,args=(parameters,))
-#
-#
-# The result_t is now an array of arrays.
-# The first index are the time steps, the second are the variable index.
-# Convert the polar coordinates back to cartesian (x,y)
-#
-x1 = L1*np.sin(result_t[:, i_theta1])
-y1 = -L1*np.cos(result_t[:,i_theta1])
-
-x2 = L2*np.sin(result_t[:, i_theta2]) + x1
-y2 = -L2*np.cos(result_t[:,i_theta2]) + y1
-#
-#  Now make a graph.
-#  The first two show the behavior of theta 1 and 2 vs time, and the same for omega.
-#  The third plot (on the same page) shows the omega vs theta phase diagram.
-#
-fig1,(ax1,ax2,ax3) = plt.subplots(3,sharex=False,figsize=(8,12))
-plt.tight_layout()
-#ax1.set_title('Double Pendulum')
-ax1.set_xlabel('time (sec)')
-ax1.set_ylabel("$\\theta$(deg)")
-ax1.plot(t,result_t[:,i_theta1]*180./np.pi,label="$\\theta_1$")
-ax1.plot(t,result_t[:,i_theta2]*180./np.pi,label="$\\theta_2$")
-ax1.legend(loc="lower right")
-
-ax2.set_xlabel('time (sec)')
-ax2.set_ylabel("$\omega$(deg/s)")
-ax2.plot(t,result_t[:,i_omega1]*180./np.pi,label="$\\omega_1$")
-ax2.plot(t,result_t[:,i_omega2]*180./np.pi,label="$\\omega_2$")
-ax2.legend(loc="lower right")
-
-ax3.plot(result_t[:,i_theta1]*180./np.pi,result_t[:,i_omega1]*180./np.pi,label="$rod_1$")
-ax3.plot(result_t[:,i_theta2]*180./np.pi,result_t[:,i_omega2]*180./np.pi,label="$rod_2$")
-ax3.set_xlabel("$\\theta$(deg)")
-ax3.set_ylabel("$\omega$(deg/s)")
-ax3.legend(loc="lower right")
-if save_output:
-    plt.savefig("double_pendulum.pdf")
-else:
-    plt.show()
-
-#
-# Here we setup the animation.
-#
-fig2 = plt.figure(figsize=(9,7))
-plt.tight_layout()
-ax = fig2.add_subplot(111, autoscale_on=False, xlim=(-(L1+L2), (L1+L2)), ylim=(-(L1+L2)*1.05, (L2)))
-ax.grid()
-
-max_trace_depth=250
-line1, = ax.plot([], [], 'o-', lw=2,color="blue") # A line without the parameters set.
-trace1, = ax.plot([],[], lw=1,color="blue")
-line2, = ax.plot([], [], 'o-', lw=2,color="red") # A line without the parameters set.
-trace2, = ax.plot([],[], lw=1,color="red")
-time_template = 'time = %.1fs'      # To print the time on the plot
-time_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
-
-
-def init():                   # initialize everything
-    line1.set_data([], [])
-    line2.set_data([], [])
-    trace1.set_data([],[])
-    trace2.set_data([],[])
-    time_text.set_text('')
-    return line1,line2,trace1,trace2, time_text
-
-
-def animate(i):               # Do animation step i.
-    thisx1 = [0, x1[i]]
-    thisy1 = [0, y1[i]]
-    thisx2 = [x1[i], x2[i]]
-    thisy2 = [y1[i], y2[i]]
-    line1.set_data(thisx1, thisy1)
-    line2.set_data(thisx2, thisy2)
-    if i < max_trace_depth:
-        trace1.set_data(x1[0:i],y1[0:i])
-        trace2.set_data(x2[0:i],y2[0:i])
+def double_pendulum_ensemble_step(states,t,params,out=None):
+    """Return the (N,4) time derivatives for the (N,4) states of an ensemble of double pendulums.
+    If out is given, the derivatives are stored in it, instead of in a new array."""
+    states = np.asarray(states)
+    theta1 = states[:, 0]
+    omega1 = states[:, 1]
+    theta2 = states[:, 2]
+    omega2 = states[:, 3]
+    l1,m1,l2,m2,g = [np.asarray(p, dtype=float) for p in params]
+
+    if out is None:
+        out = np.empty(states.shape)
+    out[:, 0] = omega1
+    out[:, 2] = omega2
+
+    cdt = np.cos(theta1-theta2)
+    sdt = np.sin(theta1-theta2)
+    sin1 = np.sin(theta1)
+    sin2 = np.sin(theta2)
+    w1sq = omega1*omega1
+    w2sq = omega2*omega2
+    # Where the mask is False, frac1 or frac2 can be zero, so divide by 1 there, and set the result to 0.
+    ok1 = (l1 > 0.) & (m1 > 0.)
+    frac1 = np.where(ok1, l1*(m1 + m2 - m2*cdt**2), 1.)
+    d_omega1 = ( -g*(m1+m2)*sin1 +
+                 g*m2*cdt*sin2 -
+                 l1*m2*w1sq*cdt*sdt -
+                 l2*m2*w2sq*sdt )/frac1
+    out[:, 1] = np.where(ok1, d_omega1, 0.)
+
+    ok2 = (l2 > 0.) & (m1 > 0.)
+    frac2 = np.where(ok2, l2*(m1 + m2 - m2*cdt*cdt), 1.)
+    d_omega2 = ((m1+m2)*(g*cdt*sin1 - g*sin2 + l1*w1sq*sdt) +
+                l2*m2*w2sq*cdt*sdt )/frac2
+    out[:, 3] = np.where(ok2, d_omega2, 0.)
+    return(out)
+
+
+def rk4_ensemble_step(states,t,h,params,rhs=double_pendulum_ensemble_step):
+    """Advance all the (N,4) states by one classical Runge-Kutta step of size h."""
+    k1 = rhs(states, t, params)
+    k2 = rhs(states + 0.5*h*k1, t + 0.5*h, params)
+    k3 = rhs(states + 0.5*h*k2, t + 0.5*h, params)
+    k4 = rhs(states + h*k3, t + h, params)
+    return states + (h/6.)*(k1 + 2.*k2 + 2.*k3 + k4)
+
+
+def integrate_ensemble(states,t,params,method="rk4",substeps=1,rtol=None,atol=None,full_output=False):
+    """Integrate the (N,4) initial states of an ensemble over the times t, and return an array of
+    shape (len(t),N,4) with the states at each time.
+    The params can have an array with one value per pendulum for any of l1,m1,l2,m2,g.
+    method="rk4" advances the whole ensemble together with fixed Runge-Kutta steps, substeps per
+    interval of t. method="odeint" integrates the flattened (4N) system with odeint, which picks one
+    step size for all pendulums, so the most chaotic one sets the pace for all.
+    Note that the result uses len(t)*N*4*8 bytes, so for a very large ensemble integrate in chunks of t.
+    With full_output=True it also returns a dictionary with the cumulative number of evaluations of the
+    (vectorized) right hand side at each time, "nfe", as in the odeint info dictionary."""
+    states = np.array(states, dtype=float).reshape(-1, 4)
+    t = np.asarray(t, dtype=float)
+    if method == "odeint":
+        n = len(states)
+        def flat_step(y, tt, params):
+            return double_pendulum_ensemble_step(y.reshape(n, 4), tt, params).ravel()
+        result = integrate.odeint(flat_step, states.ravel(), t, args=(params,), rtol=rtol, atol=atol,
+                                  full_output=full_output)
+        if full_output:
+            result, info = result
+            return result.reshape(len(t), n, 4), info
+        return result.reshape(len(t), n, 4)
+    elif method == "rk4":
+        result = np.empty((len(t),) + states.shape)
+        result[0] = states
+        for i in range(1, len(t)):
+            h = (t[i] - t[i-1])/substeps
+            for j in range(substeps):
+                states = rk4_ensemble_step(states, t[i-1] + j*h, h, params)
+            result[i] = states
+        if full_output:
+            return result, {"nfe": 4*substeps*np.arange(1, len(t)), "nje": np.zeros(len(t) - 1, dtype=int)}
+        return result
     else:
-        trace1.set_data(x1[i-max_trace_depth:i],y1[i-max_trace_depth:i])
-        trace2.set_data(x2[i-max_trace_depth:i],y2[i-max_trace_depth:i])
+        raise ValueError("Unknown method {}, use 'rk4' or 'odeint'.".format(method))
 
-    time_text.set_text(time_template % (i*dt))
-    return line1,line2,trace1,trace2, time_text
+#
+# The Jacobian of the equations, d(out[i])/d(invars[j]), for odeint(..., Dfun=...) or solve_ivp(..., jac=...).
+# Without it, a stiff method estimates the Jacobian with extra evaluations of the right hand side.
+# (odeint only switches to its stiff method when it needs to, which it does not for the pendulum.)
+#
+def double_pendulum_jacobian(invars,t,params):
+    """Return the 4x4 Jacobian matrix of double_pendulum_step at invars."""
+    l1,m1,l2,m2,g = params
+    return _pendulum_jac(np.asarray(invars, dtype=float), t, l1, m1, l2, m2, g)
+
+#
+# Scalar versions of the right hand side and Jacobian, with math instead of numpy functions, and the
+# parameters as separate arguments. These are plain Python, and can be compiled by numba as they are.
+#
+def _pendulum_rhs(invars,t,l1,m1,l2,m2,g):
+    theta1 = invars[0]
+    omega1 = invars[1]
+    theta2 = invars[2]
+    omega2 = invars[3]
+    cdt = math.cos(theta1-theta2)
+    sdt = math.sin(theta1-theta2)
+    domega1 = 0.
+    domega2 = 0.
+    if l1 > 0. and m1 > 0.:
+        frac1 = l1*(m1 + m2 - m2*cdt*cdt)
+        domega1 = (-g*(m1+m2)*math.sin(theta1) + g*m2*cdt*math.sin(theta2) -
+                   l1*m2*omega1*omega1*cdt*sdt - l2*m2*omega2*omega2*sdt)/frac1
+    if l2 > 0. and m1 > 0.:
+        frac2 = l2*(m1 + m2 - m2*cdt*cdt)
+        domega2 = ((m1+m2)*(g*cdt*math.sin(theta1) - g*math.sin(theta2) + l1*omega1*omega1*sdt) +
+                   l2*m2*omega2*omega2*cdt*sdt)/frac2
+    # A tuple, not a new numpy array for every call; odeint and solve_ivp turn it into their own array.
+    return (omega1, domega1, omega2, domega2)
+
+
+def _pendulum_jac(invars,t,l1,m1,l2,m2,g):
+    theta1 = invars[0]
+    omega1 = invars[1]
+    theta2 = invars[2]
+    omega2 = invars[3]
+    jac = np.zeros((4, 4))
+    jac[0, 1] = 1.
+    jac[2, 3] = 1.
+    mt = m1 + m2
+    cdt = math.cos(theta1-theta2)
+    sdt = math.sin(theta1-theta2)
+    c2s2 = cdt*cdt - sdt*sdt          # d(cdt*sdt)/d(theta1)
+    sin1 = math.sin(theta1)
+    sin2 = math.sin(theta2)
+    cos1 = math.cos(theta1)
+    cos2 = math.cos(theta2)
+    w1sq = omega1*omega1
+    w2sq = omega2*omega2
+    # Each row is d(num/frac) = (d(num) - (num/frac)*d(frac))/frac, and d(frac)/d(theta1) = -d(frac)/d(theta2).
+    if l1 > 0. and m1 > 0.:
+        frac1 = l1*(mt - m2*cdt*cdt)
+        f1 = (-g*mt*sin1 + g*m2*cdt*sin2 - l1*m2*w1sq*cdt*sdt - l2*m2*w2sq*sdt)/frac1
+        dfrac1 = 2.*l1*m2*cdt*sdt
+        jac[1, 0] = (-g*mt*cos1 - g*m2*sdt*sin2 - l1*m2*w1sq*c2s2 - l2*m2*w2sq*cdt - f1*dfrac1)/frac1
+        jac[1, 1] = -2.*l1*m2*omega1*cdt*sdt/frac1
+        jac[1, 2] = (g*m2*(sdt*sin2 + cdt*cos2) + l1*m2*w1sq*c2s2 + l2*m2*w2sq*cdt + f1*dfrac1)/frac1
+        jac[1, 3] = -2.*l2*m2*omega2*sdt/frac1
+    if l2 > 0. and m1 > 0.:
+        frac2 = l2*(mt - m2*cdt*cdt)
+        f2 = (mt*(g*cdt*sin1 - g*sin2 + l1*w1sq*sdt) + l2*m2*w2sq*cdt*sdt)/frac2
+        dfrac2 = 2.*l2*m2*cdt*sdt
+        jac[3, 0] = (mt*(-g*sdt*sin1 + g*cdt*cos1 + l1*w1sq*cdt) + l2*m2*w2sq*c2s2 - f2*dfrac2)/frac2
+        jac[3, 1] = 2.*mt*l1*omega1*sdt/frac2
+        jac[3, 2] = (mt*(g*sdt*sin1 - g*cos2 - l1*w1sq*cdt) - l2*m2*w2sq*c2s2 + f2*dfrac2)/frac2
+        jac[3, 3] = 2.*l2*m2*omega2*cdt*sdt/frac2
+    return jac
+
+
+def _numpy_rhs(invars,t,l1,m1,l2,m2,g):
+    return double_pendulum_step(invars, t, (l1, m1, l2, m2, g))
+
+
+_backends = {}
+
+def pendulum_backend(backend="auto"):
+    """Return the (rhs, jacobian) functions for backend "numpy" (double_pendulum_step, the original),
+    "python" (scalar math functions) or "numba" (the same, compiled by numba). "auto" is numba if it is
+    installed, otherwise python. The functions take the parameters as separate arguments, so use:
+    odeint(rhs, state, t, args=tuple(params), Dfun=jacobian)."""
+    if backend == "auto":
+        backend = "numba" if has_numba else "python"
+    if backend not in _backends:
+        if backend == "numpy":
+            _backends[backend] = (_numpy_rhs, _pendulum_jac)
+        elif backend == "python":
+            _backends[backend] = (_pendulum_rhs, _pendulum_jac)
+        elif backend == "numba":
+            if not has_numba:
+                raise ImportError("The numba backend needs numba, install it with: pip install numba")
+            import numba
+            _backends[backend] = (numba.njit(cache=True)(_pendulum_rhs), numba.njit(cache=True)(_pendulum_jac))
+        else:
+            raise ValueError("Unknown backend {}, use 'auto', 'numpy', 'python' or 'numba'.".format(backend))
+    return _backends[backend]
+
+
+def integrate_pendulum(state,t,params,backend="auto",jacobian=True,rtol=None,atol=None,full_output=False):
+    """Integrate a single double pendulum with odeint, using the functions of the backend, and the
+    analytic Jacobian if jacobian=True. With full_output=True it also returns the odeint info dictionary,
+    which has the number of function (nfe) and Jacobian (nje) evaluations.
+    Note: odeint only uses the Jacobian after it switches to its stiff method, which it does not do for
+    the pendulum, so nje is normally 0. Use solve_ivp with a stiff method to use the Jacobian."""
+    rhs, jac = pendulum_backend(backend)
+    return integrate.odeint(rhs, np.asarray(state, dtype=float), t, args=tuple(params),
+                            Dfun=jac if jacobian else None, rtol=rtol, atol=atol, full_output=full_output)
 
 
+def compare_backends(state,t,params,rtol=1.e-10,atol=1.e-10,backends=("numpy","python","numba"),
+                     stiff_method="Radau"):
+    """Integrate the same trajectory with each of the backends at the same tolerances: with odeint, and with
+    the stiff method stiff_method ("Radau" or "BDF") of solve_ivp, without and with the analytic Jacobian.
+    Without it, the stiff method estimates the Jacobian from extra evaluations of the right hand side.
+    Return a list with for each the time, the number of evaluations of the right hand side (nfe) and of the
+    Jacobian (nje), and the largest difference with the original (numpy backend, odeint) trajectory.
+    Backends that are not installed are skipped."""
+    state = np.asarray(state, dtype=float)
+    results = []
+    reference = None
+    for backend in backends:
+        try:
+            rhs, jac = pendulum_backend(backend)
+        except ImportError:
+            continue
+        if backend == "numba":     # The first call compiles, do not time that.
+            rhs(state, t[0], *params)
+            jac(state, t[0], *params)
+        for solver, jacobian in (("odeint", False), (stiff_method, False), (stiff_method, True)):
+            start = time.perf_counter()
+            if solver == "odeint":
+                result, info = integrate_pendulum(state, t, params, backend, False, rtol, atol, full_output=True)
+                nfe, nje = int(info["nfe"][-1]), int(info["nje"][-1])
+            else:
+                # The calls are counted here, because sol.nfev leaves out those for the estimated Jacobian.
+                calls = [0]
+                def fun(tt, y):
+                    calls[0] += 1
+                    return rhs(y, tt, *params)
+                sol = integrate.solve_ivp(fun, (t[0], t[-1]), state, method=solver, t_eval=t, rtol=rtol, atol=atol,
+                                          jac=(lambda tt, y: jac(y, tt, *params)) if jacobian else None)
+                result, nfe, nje = sol.y.T, calls[0], int(sol.njev)
+            seconds = time.perf_counter() - start
+            if reference is None:
+                reference = result
+            results.append({"backend": backend, "solver": solver, "jacobian": jacobian, "seconds": seconds,
+                            "nfe": nfe, "nje": nje, "max_diff": float(np.abs(result - reference).max())})
+    return results
+
 #
-#  Now run the animation.
+# Fixed step integrators, with the energy checked along the way.
+# odeint with its default tolerances lets the energy drift over long runs, and tighter tolerances make it slow.
+# With a fixed number of steps the cost is known up front, and the energy drift shows what accuracy that buys.
 #
+def double_pendulum_energy(states,params):
+    """Return the total energy (kinetic + potential) of the (N,4) or (4,) states, for params (l1,m1,l2,m2,g)."""
+    states = np.asarray(states)
+    theta1, omega1, theta2, omega2 = states[..., 0], states[..., 1], states[..., 2], states[..., 3]
+    l1,m1,l2,m2,g = params
+    kinetic = (0.5*(m1+m2)*l1*l1*omega1*omega1 + 0.5*m2*l2*l2*omega2*omega2 +
+               m2*l1*l2*omega1*omega2*np.cos(theta1-theta2))
+    potential = -(m1+m2)*g*l1*np.cos(theta1) - m2*g*l2*np.cos(theta2)
+    return kinetic + potential
+
+
+class PendulumEngine(object):
+    """Fixed step integrator for an ensemble of double pendulums, with steps of dt, using method:
+    "rk4": classical Runge-Kutta, 4 evaluations per step, energy error of order dt**4 that slowly drifts.
+    "midpoint": the implicit midpoint rule on the canonical variables (theta, p), which is symplectic, so the
+    energy error stays bounded and does not drift. Each step is solved by fixed point iteration, to tol.
+    The parameters can be numbers or arrays with one value per pendulum. All the work arrays are allocated
+    once per ensemble size, and re-used for every step."""
+
+    def __init__(self, params, dt, method="rk4", tol=1.e-12, max_iterations=50):
+        if method not in ("rk4", "midpoint"):
+            raise ValueError("Unknown method {}, use 'rk4' or 'midpoint'.".format(method))
+        self.params = tuple(np.asarray(p, dtype=float) for p in params)
+        l1, m1, l2, m2, g = self.params
+        if method == "midpoint" and not (np.all(l1 > 0) and np.all(l2 > 0) and np.all(m1 > 0) and np.all(m2 > 0)):
+            raise ValueError("The midpoint method needs all lengths and masses larger than zero.")
+        self.dt = dt
+        self.method = method
+        self.tol = tol
+        self.max_iterations = max_iterations
+        self.rhs_evals = 0
+        self._buffers = None
+
+    def _allocate(self, n):
+        if self._buffers is None or self._buffers["n"] != n:
+            self._buffers = {"n": n}
+            for name in ("k1", "k2", "k3", "k4", "tmp", "z", "z1", "zm"):
+                self._buffers[name] = np.empty((n, 4))
+        return self._buffers
+
+    def _to_momenta(self, y, z):
+        """Store the canonical state (theta1, p1, theta2, p2) for the state y in z."""
+        l1, m1, l2, m2, g = self.params
+        b = m2*l1*l2*np.cos(y[:, 0] - y[:, 2])
+        z[:, 0] = y[:, 0]
+        z[:, 2] = y[:, 2]
+        z[:, 1] = (m1+m2)*l1*l1*y[:, 1] + b*y[:, 3]
+        z[:, 3] = m2*l2*l2*y[:, 3] + b*y[:, 1]
+
+    def _velocities(self, z):
+        """Return omega1, omega2 for the canonical state z, by solving p = M(theta) omega."""
+        l1, m1, l2, m2, g = self.params
+        a = (m1+m2)*l1*l1
+        d = m2*l2*l2
+        b = m2*l1*l2*np.cos(z[:, 0] - z[:, 2])
+        det = a*d - b*b
+        return (d*z[:, 1] - b*z[:, 3])/det, (a*z[:, 3] - b*z[:, 1])/det
+
+    def _to_state(self, z, y):
+        """Store the state (theta1, omega1, theta2, omega2) for the canonical state z in y."""
+        omega1, omega2 = self._velocities(z)
+        y[:, 0] = z[:, 0]
+        y[:, 2] = z[:, 2]
+        y[:, 1] = omega1
+        y[:, 3] = omega2
+
+    def _canonical_rhs(self, z, out):
+        """Store Hamilton's equations, d(theta1, p1, theta2, p2)/dt, for the canonical state z in out."""
+        l1, m1, l2, m2, g = self.params
+        omega1, omega2 = self._velocities(z)
+        coupling = m2*l1*l2*omega1*omega2*np.sin(z[:, 0] - z[:, 2])
+        out[:, 0] = omega1
+        out[:, 2] = omega2
+        out[:, 1] = -coupling - (m1+m2)*g*l1*np.sin(z[:, 0])
+        out[:, 3] = coupling - m2*g*l2*np.sin(z[:, 2])
+        self.rhs_evals += 1
+
+    def step(self, y, t=0.):
+        """Advance the (N,4) states y by one step, in place."""
+        h = self.dt
+        buf = self._allocate(len(y))
+        if self.method == "rk4":
+            k1, k2, k3, k4, tmp = buf["k1"], buf["k2"], buf["k3"], buf["k4"], buf["tmp"]
+            double_pendulum_ensemble_step(y, t, self.params, out=k1)
+            np.multiply(k1, 0.5*h, out=tmp)
+            tmp += y
+            double_pendulum_ensemble_step(tmp, t + 0.5*h, self.params, out=k2)
+            np.multiply(k2, 0.5*h, out=tmp)
+            tmp += y
+            double_pendulum_ensemble_step(tmp, t + 0.5*h, self.params, out=k3)
+            np.multiply(k3, h, out=tmp)
+            tmp += y
+            double_pendulum_ensemble_step(tmp, t + h, self.params, out=k4)
+            self.rhs_evals += 4
+            k2 += k3
+            k2 *= 2.
+            k1 += k2
+            k1 += k4
+            k1 *= h/6.
+            y += k1
+        else:
+            z, z1, zm, k = buf["z"], buf["z1"], buf["zm"], buf["k1"]
+            self._to_momenta(y, z)
+            # Start from an explicit Euler step, then iterate z1 = z + h*f((z + z1)/2).
+            self._canonical_rhs(z, k)
+            np.multiply(k, h, out=z1)
+            z1 += z
+            for iteration in range(self.max_iterations):
+                np.add(z, z1, out=zm)
+                zm *= 0.5
+                self._canonical_rhs(zm, k)
+                k *= h
+                k += z
+                change = np.abs(k - z1).max()
+                z1[:] = k
+                if change < self.tol:
+                    break
+            self._to_state(z1, y)
+        return y
+
+    def run(self, states, n_steps, record_every=1):
+        """Integrate the (N,4) states (or a single (4,) state) for n_steps steps, and return a dictionary with
+        "t": the recorded times, "states": the states every record_every steps, "energy": the energy of each
+        recorded state, "drift": the energy change since the start, relative to the energy scale of the
+        pendulum, "max_drift": the largest of those, "rhs_evals": the evaluations of the equations, and
+        "seconds": the time it took. The result arrays are allocated before the run starts."""
+        y = np.array(states, dtype=float)
+        single = y.ndim == 1
+        y = y.reshape(-1, 4)
+        n_records = n_steps//record_every + 1
+        t_rec = np.arange(n_records)*record_every*self.dt
+        states_rec = np.empty((n_records,) + y.shape)
+        energy_rec = np.empty((n_records, len(y)))
+        states_rec[0] = y
+        energy_rec[0] = double_pendulum_energy(y, self.params)
+        self.rhs_evals = 0
+        start = time.perf_counter()
+        for i in range(1, n_steps + 1):
+            self.step(y, (i - 1)*self.dt)
+            if i % record_every == 0:
+                states_rec[i//record_every] = y
+                energy_rec[i//record_every] = double_pendulum_energy(y, self.params)
+        seconds = time.perf_counter() - start
+        l1, m1, l2, m2, g = self.params
+        scale = (m1+m2)*g*l1 + m2*g*l2          # The depth of the potential, which sets the energy scale.
+        drift = (energy_rec - energy_rec[0])/scale
+        if single:
+            states_rec, energy_rec, drift = states_rec[:, 0], energy_rec[:, 0], drift[:, 0]
+        return {"t": t_rec, "states": states_rec, "energy": energy_rec, "drift": drift,
+                "max_drift": float(np.abs(drift).max()), "rhs_evals": self.rhs_evals, "seconds": seconds}
+
+
 #
-# For more on how to animate your results, see:
-# https://matplotlib.org/api/animation_api.html
-# and
-# https://jakevdp.github.io/blog/2012/08/18/matplotlib-animation-tutorial
+# Streaming: compute the pendulum while the animation runs.
+# A background thread integrates chunks of chunk_steps steps ahead of the frame that is shown, and puts them
+# in a queue that holds at most buffer_chunks chunks. The time to the first frame is the time of one chunk,
+# and the memory is that of the buffer, no matter how long the simulation runs.
 #
-ani = animation.FuncAnimation(fig2, animate, np.arange(1, len(result_t)),
-                              interval=2, blit=True, init_func=init)
-# Note: interval is the delay between frames in ms, IF your computer can keep up.
-# So a larger number slows down the animation, a smaller number speeds it up.
-# To get "real time" you would want this to be dt*1000.
+class PendulumStream(object):
+    """Iterate over the frames (i, t, x1, y1, x2, y2) of a double pendulum that starts at state, with steps dt,
+    computed in chunks in a background thread. With max_time=None the stream never ends.
+    The states of the chunks are in self.last_chunk (t, result) as they are used.
+    A stream is iterated only once: a second iteration, after the end, yields nothing. Make a new stream to
+    start again, and close() a stream that is no longer used."""
+
+    def __init__(self, state, params, dt, max_time=None, chunk_steps=200, buffer_chunks=4, backend="auto",
+                 rtol=None, atol=None):
+        self.state = np.asarray(state, dtype=float)
+        self.params = tuple(params)
+        self.dt = dt
+        self.max_steps = None if max_time is None else len(np.arange(0.0, max_time, dt))
+        self.chunk_steps = chunk_steps
+        self.backend = backend
+        self.rtol = rtol
+        self.atol = atol
+        self.last_chunk = None
+        self._queue = queue.Queue(maxsize=buffer_chunks)
+        self._stop = threading.Event()
+        self._thread = None
+        self._finished = False
+
+    def _put(self, item):
+        """Put item in the queue, waiting for room, unless the stream is closed."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            rhs, jac = pendulum_backend(self.backend)
+            l1, m1, l2, m2, g = self.params
+            state = self.state
+            i0 = 0
+            while self.max_steps is None or i0 < self.max_steps:
+                n = self.chunk_steps if self.max_steps is None else min(self.chunk_steps, self.max_steps - i0)
+                # One step more than n, the last state is the start of the next chunk.
+                t = (i0 + np.arange(n + 1))*self.dt
+                result = integrate.odeint(rhs, state, t, args=self.params, Dfun=jac, rtol=self.rtol, atol=self.atol)
+                x1 = l1*np.sin(result[:n, 0])
+                y1 = -l1*np.cos(result[:n, 0])
+                x2 = l2*np.sin(result[:n, 2]) + x1
+                y2 = -l2*np.cos(result[:n, 2]) + y1
+                if not self._put((i0, t[:n], result[:n], x1, y1, x2, y2)):
+                    return
+                state = result[n]
+                i0 += n
+            self._put(None)
+        except Exception as error:
+            self._put(error)
+
+    def __iter__(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._produce, daemon=True)
+            self._thread.start()
+        while not self._finished:
+            chunk = self._queue.get()
+            if chunk is None:
+                self._finished = True
+                return
+            if isinstance(chunk, Exception):
+                self._finished = True
+                raise chunk
+            i0, t, result, x1, y1, x2, y2 = chunk
+            self.last_chunk = (t, result)
+            for k in range(len(t)):
+                yield i0 + k, t[k], x1[k], y1[k], x2[k], y2[k]
+
+    def close(self):
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+#
+# Drawing of the animation frames. The same functions set up the figure for the animation on screen,
+# for ani.save(), and for the parallel movie export in render_movie(), so all of them draw the same pixels.
 #
-# Don't make the movie.
-# video = HTML(ani.to_html5_video())
+def setup_pendulum_figure(fig,l1,l2):
+    """Add the axes, rods, traces and time text for the animation to fig, and return the artists
+    (line1, line2, trace1, trace2, time_text)."""
+    fig.tight_layout()
+    ax = fig.add_subplot(111, autoscale_on=False, xlim=(-(l1+l2), (l1+l2)), ylim=(-(l1+l2)*1.05, (l2)))
+    ax.grid()
+    line1, = ax.plot([], [], 'o-', lw=2,color="blue") # A line without the parameters set.
+    trace1, = ax.plot([],[], lw=1,color="blue")
+    line2, = ax.plot([], [], 'o-', lw=2,color="red") # A line without the parameters set.
+    trace2, = ax.plot([],[], lw=1,color="red")
+    time_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
+    return line1, line2, trace1, trace2, time_text
+
+
+def draw_pendulum_frame(artists,i,x1,y1,x2,y2,dt,max_trace_depth=250,time_template='time = %.1fs'):
+    """Set the artists from setup_pendulum_figure() to animation step i, and return them."""
+    line1, line2, trace1, trace2, time_text = artists
+    line1.set_data([0, x1[i]], [0, y1[i]])
+    line2.set_data([x1[i], x2[i]], [y1[i], y2[i]])
+    start = max(i - max_trace_depth, 0)
+    trace1.set_data(x1[start:i], y1[start:i])
+    trace2.set_data(x2[start:i], y2[start:i])
+    time_text.set_text(time_template % (i*dt))
+    return artists
+
 #
-# Just show the result.
-if save_output:
-    ani.save(filename="double_pendulum.mp4",fps=60)
-else:
-    plt.show()
+# Parallel movie export.
+# Each worker process draws a chunk of frames on its own (Agg) copy of the figure, and returns the raw RGBA
+# bytes, exactly what ani.save() pipes to ffmpeg for each frame. The chunks are written to a single ffmpeg
+# process in order, started by matplotlib's own FFMpegWriter, so the encoder and its arguments are the same.
+# At most 2 chunks per process are in flight, which bounds the memory.
+#
+_render = {}
+
+def _render_init(x1,y1,x2,y2,l1,l2,dt,max_trace_depth,figsize,dpi,frame_format):
+    """Set up the figure in a worker process."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    artists = setup_pendulum_figure(fig, l1, l2)
+    _render.update(fig=fig, artists=artists, positions=(x1, y1, x2, y2), dt=dt,
+                   max_trace_depth=max_trace_depth, dpi=dpi, frame_format=frame_format)
+
+
+def _render_chunk(frames):
+    """Draw the frames in a worker process, and return the RGBA bytes of all of them."""
+    import matplotlib
+    output = io.BytesIO()
+    with matplotlib.rc_context({'savefig.bbox': None}):    # As in Animation.save()
+        for i in frames:
+            draw_pendulum_frame(_render["artists"], i, *_render["positions"], _render["dt"],
+                                _render["max_trace_depth"])
+            _render["fig"].savefig(output, format=_render["frame_format"], dpi=_render["dpi"])
+    return output.getvalue()
+
+
+def render_movie(filename,x1,y1,x2,y2,l1,l2,dt,fps=60,frames=None,processes=None,chunk_frames=50,
+                 max_trace_depth=250,figsize=(9,7)):
+    """Write the animation of the pendulum positions x1,y1,x2,y2 to the movie filename, drawing the frames
+    in a pool of processes (default one per core). The frames default to 1..len(x1)-1, as in the animation."""
+    import matplotlib
+    import matplotlib.animation as animation
+    from matplotlib.figure import Figure
+
+    class RawFFMpegWriter(animation.FFMpegWriter):
+        """The matplotlib ffmpeg writer, which takes frames that are already drawn."""
+        def write_frames(self, data):
+            self._proc.stdin.write(data)
+
+    if frames is None:
+        frames = np.arange(1, len(x1))
+    fig = Figure(figsize=figsize)
+    dpi = matplotlib.rcParams['savefig.dpi']
+    if dpi == 'figure':
+        dpi = fig.dpi
+    writer = RawFFMpegWriter(fps=fps)
+    with matplotlib.rc_context({'savefig.bbox': None}):
+        writer.setup(fig, filename, dpi)      # This can adjust the figure size for the codec.
+    figsize = tuple(fig.get_size_inches())
+
+    chunks = iter([frames[k:k + chunk_frames] for k in range(0, len(frames), chunk_frames)])
+    if processes is None:
+        processes = os.cpu_count()
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_render_init,
+                                 initargs=(x1, y1, x2, y2, l1, l2, dt, max_trace_depth, figsize, dpi,
+                                           writer.frame_format)) as pool:
+            pending = collections.deque(pool.submit(_render_chunk, chunk)
+                                        for chunk in itertools.islice(chunks, 2*processes))
+            while pending:
+                data = pending.popleft().result()
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    pending.append(pool.submit(_render_chunk, chunk))
+                writer.write_frames(data)
+    finally:
+        writer.finish()
+
+#
+# Parameter sweeps for chaos maps: the time to the first flip, and the largest Lyapunov exponent, on a grid of
+# two of the initial values or parameters, e.g. (theta1_0, theta2_0), or (m2, l2).
+# The grid is cut in tiles, each tile is integrated as one ensemble (see integrate_ensemble) in a pool of
+# processes, and the results are written to memory mapped .npy files. A small "done" array records the
+# finished tiles, so a sweep that was stopped continues where it was when it is run again.
+#
+sweep_variables = {"theta1": ("state", 0), "omega1": ("state", 1), "theta2": ("state", 2), "omega2": ("state", 3),
+                   "l1": ("params", 0), "m1": ("params", 1), "l2": ("params", 2), "m2": ("params", 3),
+                   "g": ("params", 4)}
+
+
+def _sweep_tile(spec,iy0,iy1,ix0,ix1):
+    """Integrate the grid points [iy0:iy1, ix0:ix1] of the sweep spec, and return a dictionary with the
+    arrays of the quantities for this tile."""
+    ny, nx = spec["shape"]
+    xs = np.linspace(spec["x_axis"][1], spec["x_axis"][2], nx)[ix0:ix1]
+    ys = np.linspace(spec["y_axis"][1], spec["y_axis"][2], ny)[iy0:iy1]
+    yy, xx = np.meshgrid(ys, xs, indexing="ij")
+    n = yy.size
+    states = np.tile(np.asarray(spec["state"], dtype=float), (n, 1))
+    params = [np.full(n, float(p)) for p in spec["params"]]
+    for (name, start, stop), values in ((spec["x_axis"], xx), (spec["y_axis"], yy)):
+        kind, index = sweep_variables[name]
+        if kind == "state":
+            states[:, index] = values.ravel()
+        else:
+            params[index] = values.ravel()
+
+    lyapunov = "lyapunov" in spec["quantities"]
+    d0 = spec["d0"]
+    if lyapunov:
+        # The second half of the ensemble are the same pendulums, displaced by d0 in theta1.
+        states = np.concatenate([states, states + np.array([d0, 0., 0., 0.])])
+        params = [np.concatenate([p, p]) for p in params]
+    flip_time = np.full(n, np.inf)
+    log_growth = np.zeros(n)
+
+    dt = spec["dt"]
+    n_steps = int(round(spec["t_max"]/dt))
+    for step in range(1, n_steps + 1):
+        states = rk4_ensemble_step(states, (step - 1)*dt, dt, params)
+        # A pendulum flips when one of the rods goes over the top.
+        flipped = (np.abs(states[:n, 0]) > np.pi) | (np.abs(states[:n, 2]) > np.pi)
+        flip_time[flipped & np.isinf(flip_time)] = step*dt
+        if lyapunov:
+            if step % spec["renorm_every"] == 0 or step == n_steps:
+                delta = states[n:] - states[:n]
+                distance = np.sqrt((delta*delta).sum(axis=1))
+                log_growth += np.log(distance/d0)
+                states[n:] = states[:n] + delta*(d0/distance)[:, np.newaxis]
+        elif not np.isinf(flip_time).any():
+            break
+
+    shape = (iy1 - iy0, ix1 - ix0)
+    out = {"flip_time": flip_time.reshape(shape)}
+    if lyapunov:
+        out["lyapunov"] = (log_growth/(n_steps*dt)).reshape(shape)
+    return {q: out[q] for q in spec["quantities"]}
+
+
+class ChaosSweep(object):
+    """A resumable sweep over a grid of shape (ny, nx) of the axes x_axis and y_axis, each a tuple
+    (name, start, stop) with a name from sweep_variables (angles in radians).
+    The other initial values come from state and the parameters from params (l1,m1,l2,m2,g).
+    Each grid point is integrated with fixed RK4 steps of dt up to t_max, for the quantities:
+    "flip_time": the time at which one of the rods first goes over the top (inf if it does not before t_max),
+    "lyapunov": the largest Lyapunov exponent, from the growth of a displacement d0, renormalized every
+    renorm_every steps.
+    The results are in directory/<quantity>.npy, which can be opened with np.load(..., mmap_mode="r").
+    Points that were not computed yet are NaN."""
+
+    def __init__(self, directory, shape=(256, 256), x_axis=("theta1", -np.pi, np.pi),
+                 y_axis=("theta2", -np.pi, np.pi), state=(0., 0., 0., 0.), params=(1.0, 1.1, 0.47, 0.5, 9.8),
+                 t_max=10., dt=0.01, tile=64, quantities=("flip_time", "lyapunov"), renorm_every=10, d0=1.e-8):
+        for axis in (x_axis, y_axis):
+            if axis[0] not in sweep_variables:
+                raise ValueError("Unknown sweep variable {}, use one of {}".format(axis[0], list(sweep_variables)))
+        self.directory = directory
+        self.spec = {"shape": [int(s) for s in shape], "x_axis": [x_axis[0], float(x_axis[1]), float(x_axis[2])],
+                     "y_axis": [y_axis[0], float(y_axis[1]), float(y_axis[2])],
+                     "state": [float(s) for s in state], "params": [float(p) for p in params],
+                     "t_max": float(t_max), "dt": float(dt), "tile": int(tile), "quantities": list(quantities),
+                     "renorm_every": int(renorm_every), "d0": float(d0)}
+        os.makedirs(directory, exist_ok=True)
+        spec_file = os.path.join(directory, "sweep.json")
+        if os.path.exists(spec_file):
+            with open(spec_file) as infile:
+                if json.load(infile) != self.spec:
+                    raise ValueError("The sweep in {} has other settings, use a new directory.".format(directory))
+            mode = "r+"
+        else:
+            mode = "w+"
+        ny, nx = self.spec["shape"]
+        self.tiles_shape = (-(-ny // tile), -(-nx // tile))
+        self.results = {}
+        for q in quantities:
+            self.results[q] = np.lib.format.open_memmap(os.path.join(directory, q + ".npy"), mode=mode,
+                                                        dtype=np.float32, shape=(ny, nx))
+            if mode == "w+":
+                self.results[q][:] = np.nan
+        self.done = np.lib.format.open_memmap(os.path.join(directory, "done.npy"), mode=mode, dtype=np.bool_,
+                                              shape=self.tiles_shape)
+        if mode == "w+":
+            self.done[:] = False
+            self.flush()
+            # Written last, so a directory with a sweep.json always has the arrays.
+            with open(spec_file, "w") as output:
+                json.dump(self.spec, output)
+
+    def tiles(self):
+        """Return the list of (ty, tx, iy0, iy1, ix0, ix1) of the tiles that are not done yet."""
+        ny, nx = self.spec["shape"]
+        tile = self.spec["tile"]
+        return [(ty, tx, ty*tile, min((ty + 1)*tile, ny), tx*tile, min((tx + 1)*tile, nx))
+                for ty in range(self.tiles_shape[0]) for tx in range(self.tiles_shape[1]) if not self.done[ty, tx]]
+
+    def progress(self):
+        """Return the fraction of the tiles that are done."""
+        return float(self.done.mean())
+
+    def flush(self):
+        for result in self.results.values():
+            result.flush()
+        self.done.flush()
+
+    def _store(self, tile, result):
+        ty, tx, iy0, iy1, ix0, ix1 = tile
+        for q, values in result.items():
+            self.results[q][iy0:iy1, ix0:ix1] = values
+        for q in result:
+            self.results[q].flush()
+        # Only mark the tile as done when its results are on disk.
+        self.done[ty, tx] = True
+        self.done.flush()
+
+    def run(self, processes=None, verbose=False):
+        """Compute all the tiles that are not done yet, in a pool of processes (default one per core),
+        and return the dictionary of result arrays. processes=1 computes them in this process."""
+        todo = self.tiles()
+        if processes == 1:
+            for tile in todo:
+                self._store(tile, _sweep_tile(self.spec, *tile[2:]))
+                if verbose:
+                    print("Sweep {:.1%} done".format(self.progress()))
+            return self.results
+        if processes is None:
+            processes = os.cpu_count()
+        tiles = iter(todo)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            pending = {pool.submit(_sweep_tile, self.spec, *tile[2:]): tile
+                       for tile in itertools.islice(tiles, 2*processes)}
+            while pending:
+                finished, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self._store(pending.pop(future), future.result())
+                    tile = next(tiles, None)
+                    if tile is not None:
+                        pending[pool.submit(_sweep_tile, self.spec, *tile[2:])] = tile
+                if verbose:
+                    print("Sweep {:.1%} done".format(self.progress()))
+        return self.results
+
+def main():
+    """Run the double pendulum: make the graphs and the animation, or save them to files."""
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+    #
+    # Setup the constants for the problem.
+    #
+    save_output = True  # Set to True to save the output to file.
+    streaming = False   # Set to True to compute the pendulum while the animation runs, see PendulumStream.
+    # Processes to draw the movie frames with render_movie(). 1 uses ani.save(). Check that render_movie() makes
+    # the same frames with your ffmpeg first: python benchmark_double_pendulum.py --check-export
+    export_processes = 1
+    G = 9.8  # acceleration due to gravity, in m/s^2
+    L1 = 1.0  # length of pendulum 1 in m
+    M1 = 1.1  # mass of pendulum 1 in kg
+    L2 = 0.47  # length of pendulum 2 in m
+    M2 = 0.5  # mass of pendulum 2 in kg
+    parameters = (L1,M1,L2,M2,G)
+    # theta1_0 and theta2_0 are the initial angles (degrees)
+    # omega1_0 and omega2_0 are the initial angular velocities (degrees per second)
+    theta1_0 = 80.0
+    omega1_0 = 0.0
+    theta2_0 = -25.0
+    omega2_0 = 0.0
+
+    # Define the Initial State of the problem.
+    state = np.radians([theta1_0,omega1_0,theta2_0,omega2_0])
+
+    # create a time array from 0..60 seconds, sampled at dt second steps
+    # Making the step size too small increases computational time, but makes the solution more accurate.
+    Max_time = 60
+    dt = 0.01
+    t = np.arange(0.0, Max_time, dt)
+
+    #
+    # For clarity of coding, define the indexes.
+    #
+    i_theta1 = 0
+    i_omega1 = 1
+    i_theta2 = 2
+    i_omega2 = 3
+
+    # In streaming mode the pendulum is computed while the animation runs, and there are no phase plots,
+    # since those need the whole run.
+    if not streaming:
+        # We integrate the ODE using scipy.integrate. This does the computational heavy lifting for us.
+        result_t = integrate.odeint(double_pendulum_step, state, t,args=(parameters,))
+        #
+        #
+        # The result_t is now an array of arrays.
+        # The first index are the time steps, the second are the variable index.
+        # Convert the polar coordinates back to cartesian (x,y)
+        #
+        x1 = L1*np.sin(result_t[:, i_theta1])
+        y1 = -L1*np.cos(result_t[:,i_theta1])
+
+        x2 = L2*np.sin(result_t[:, i_theta2]) + x1
+        y2 = -L2*np.cos(result_t[:,i_theta2]) + y1
+        #
+        #  Now make a graph.
+        #  The first two show the behavior of theta 1 and 2 vs time, and the same for omega.
+        #  The third plot (on the same page) shows the omega vs theta phase diagram.
+        #
+        fig1,(ax1,ax2,ax3) = plt.subplots(3,sharex=False,figsize=(8,12))
+        plt.tight_layout()
+        #ax1.set_title('Double Pendulum')
+        ax1.set_xlabel('time (sec)')
+        ax1.set_ylabel("$\\theta$(deg)")
+        ax1.plot(t,result_t[:,i_theta1]*180./np.pi,label="$\\theta_1$")
+        ax1.plot(t,result_t[:,i_theta2]*180./np.pi,label="$\\theta_2$")
+        ax1.legend(loc="lower right")
+
+        ax2.set_xlabel('time (sec)')
+        ax2.set_ylabel("$\omega$(deg/s)")
+        ax2.plot(t,result_t[:,i_omega1]*180./np.pi,label="$\\omega_1$")
+        ax2.plot(t,result_t[:,i_omega2]*180./np.pi,label="$\\omega_2$")
+        ax2.legend(loc="lower right")
+
+        ax3.plot(result_t[:,i_theta1]*180./np.pi,result_t[:,i_omega1]*180./np.pi,label="$rod_1$")
+        ax3.plot(result_t[:,i_theta2]*180./np.pi,result_t[:,i_omega2]*180./np.pi,label="$rod_2$")
+        ax3.set_xlabel("$\\theta$(deg)")
+        ax3.set_ylabel("$\omega$(deg/s)")
+        ax3.legend(loc="lower right")
+        if save_output:
+            plt.savefig("double_pendulum.pdf")
+        else:
+            plt.show()
+
+    #
+    # Here we setup the animation.
+    #
+    fig2 = plt.figure(figsize=(9,7))
+    max_trace_depth=250
+    artists = setup_pendulum_figure(fig2, L1, L2)
+    line1,line2,trace1,trace2,time_text = artists
+    time_template = 'time = %.1fs'      # To print the time on the plot
+
+
+    def init():                   # initialize everything
+        line1.set_data([], [])
+        line2.set_data([], [])
+        trace1.set_data([],[])
+        trace2.set_data([],[])
+        time_text.set_text('')
+        return line1,line2,trace1,trace2, time_text
+
+
+    def animate(i):               # Do animation step i.
+        return draw_pendulum_frame(artists, i, x1, y1, x2, y2, dt, max_trace_depth, time_template)
+
+
+    # For the streaming mode, the trace is kept in buffers of the last max_trace_depth positions.
+    trace_buffers = [collections.deque(maxlen=max_trace_depth) for k in range(4)]
+
+    def animate_frame(frame):     # Do animation step for a frame (i, t, x1, y1, x2, y2) from a PendulumStream.
+        i, ti, fx1, fy1, fx2, fy2 = frame
+        line1.set_data([0, fx1], [0, fy1])
+        line2.set_data([fx1, fx2], [fy1, fy2])
+        trace1.set_data(list(trace_buffers[0]), list(trace_buffers[1]))
+        trace2.set_data(list(trace_buffers[2]), list(trace_buffers[3]))
+        for buffer, value in zip(trace_buffers, (fx1, fy1, fx2, fy2)):
+            buffer.append(value)
+        time_text.set_text(time_template % ti)
+        return line1,line2,trace1,trace2, time_text
+
+
+    #
+    #  Now run the animation.
+    #
+    #
+    # For more on how to animate your results, see:
+    # https://matplotlib.org/api/animation_api.html
+    # and
+    # https://jakevdp.github.io/blog/2012/08/18/matplotlib-animation-tutorial
+    #
+    if streaming:
+        # The frames come from the stream as they are computed. Keeping them (cache_frame_data) would make
+        # the memory grow with the run time again. The frames are given as a function, which makes a new
+        # stream each time the animation starts (again), so FuncAnimation does not keep the frames to
+        # repeat them, and never waits on a stream that has ended.
+        streams = []
+
+        def new_stream():
+            if streams:
+                streams.pop().close()
+            streams.append(PendulumStream(state, parameters, dt, Max_time))
+            return iter(streams[-1])
+
+        ani = animation.FuncAnimation(fig2, animate_frame, new_stream, interval=2, blit=True, init_func=init,
+                                      cache_frame_data=False, save_count=len(t))
+    else:
+        ani = animation.FuncAnimation(fig2, animate, np.arange(1, len(result_t)),
+                                      interval=2, blit=True, init_func=init)
+    # Note: interval is the delay between frames in ms, IF your computer can keep up.
+    # So a larger number slows down the animation, a smaller number speeds it up.
+    # To get "real time" you would want this to be dt*1000.
+    #
+    # Don't make the movie.
+    # from IPython.display import HTML
+    # video = HTML(ani.to_html5_video())
+    #
+    # Just show the result.
+    if save_output:
+        if streaming or export_processes == 1:
+            ani.save(filename="double_pendulum.mp4",fps=60)
+        else:
+            # The same movie, with the frames drawn on all cores.
+            render_movie("double_pendulum.mp4", x1, y1, x2, y2, L1, L2, dt, fps=60, processes=export_processes,
+                         max_trace_depth=max_trace_depth)
+    else:
+        plt.show()
+    if streaming:
+        for stream in streams:
+            stream.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,23 +12,47 @@ from matplotlib import colors as ccc
 pio.templates.default = "plotly_white"
 
 
-def t_prime(t, x, u) -> float:
-    """Compute the relativistic t' from t_p """
-    gamma = 1 / (m.sqrt(1 - u * u))
+def t_prime(t, x, u) -> np.ndarray | float:
+    """Compute the relativistic t' from t_p.
+    Works on numbers or numpy arrays of events t, x and velocities u, which are broadcast against each other."""
+    gamma = 1 / (np.sqrt(1 - u * u))
     return gamma * (t - x * u)
 
 
-def x_prime(t, x, u) -> float:
-    """Compute the relativistic x' from t_p and x_p """
-    gamma = 1 / (m.sqrt(1 - u * u))
+def x_prime(t, x, u) -> np.ndarray | float:
+    """Compute the relativistic x' from t_p and x_p.
+    Works on numbers or numpy arrays of events t, x and velocities u, which are broadcast against each other."""
+    gamma = 1 / (np.sqrt(1 - u * u))
     return gamma * (x - u * t)
 
 
-def rel_add_velocity(v1, v2) -> float:
-    """Add velocity v1 and v2 relativistically. Assumed is that the velocities are in units of c"""
+def lorentz_boost(t, x, u):
+    """Boost the events (t, x) to a frame moving with velocity u, and return (t', x').
+    The t, x and u can be arrays, which are broadcast against each other, so a batch of velocities u[:, None]
+    boosts all the events for each velocity at once. Units are such that c = 1."""
+    t = np.asarray(t, dtype=float)
+    x = np.asarray(x, dtype=float)
+    u = np.asarray(u, dtype=float)
+    gamma = 1 / np.sqrt(1 - u * u)
+    return gamma * (t - x * u), gamma * (x - u * t)
+
+
+def rel_add_velocity(v1, v2) -> np.ndarray | float:
+    """Add velocity v1 and v2 relativistically. Assumed is that the velocities are in units of c.
+    Works on numbers or numpy arrays."""
     return (v1 + v2)/(1 + v1*v2)
 
 
+def _line_segments(x, y):
+    """Turn the (n, 2) arrays of line end points x and y into the flat lists, with None between the lines,
+    that plotly draws as n separate lines."""
+    xx = np.empty(x.shape[:-1] + (3,), dtype=object)
+    yy = np.empty(y.shape[:-1] + (3,), dtype=object)
+    xx[..., :2] = x
+    yy[..., :2] = y
+    return xx.ravel().tolist(), yy.ravel().tolist()
+
+
 class Actor(object):
 
     def __init__(self, name, velocity, position=0, color='rgba(0,255,0,1.)', size=5):
@@ -120,39 +144,50 @@ class MinkowsiPlot(object):
             u = u - 0.001
         return u
 
+    def compute_u_steps(self):
+        """Compute the u velocities for all the slider steps at once, as a numpy array."""
+        u = np.arange(self.SliderSteps) / (self.SliderSteps // 2) - 1.
+        u[u == -1.] += 0.001
+        u[u == 1.] -= 0.001
+        return u
+
+    def actor_events(self, actor):
+        """Return the (t, x) of the dots along the world line of the actor, as numpy arrays."""
+        t = actor.gamma * ((np.arange(actor.NDots) - actor.NDots//2) * actor.DotSpacing)
+        if actor.PositiveOnly:
+            t = t[t >= 0]
+        return t, actor.position + actor.velocity*t
+
     def add_actor_trace(self, fig, actor):
         """Add the dots for the actor to the figure"""
+        #
+        # The dots and grids are computed for all slider steps at once: the events of the actor are boosted
+        # with the (steps, 1) array of velocities, and the grids are made for the (steps,) array of relative
+        # velocities. The loop below only hands the rows to plotly.
+        #
+        u = self.compute_u_steps()
+        t, x = self.actor_events(actor)
+        yy, xx = lorentz_boost(t, x, u[:, np.newaxis])
+        x_grids, y_grids = self.make_grids(rel_add_velocity(u, -actor.velocity))
 
         for i in range(self.SliderSteps):
-            u = self.compute_u_from_step(i)
-            xx = []
-            yy = []
-
-            for itt in range(actor.NDots):
-                tt = (itt - actor.NDots//2)*actor.DotSpacing
-                t = actor.gamma * tt
-                if t >= 0 or actor.PositiveOnly is False:
-                    xx.append(x_prime(t, actor.position + actor.velocity*t, u))
-                    yy.append(t_prime(t, actor.position + actor.velocity*t, u))
-
             fig.add_trace(go.Scatter(
                 marker=dict(color=actor.color_rgba(1.), size=actor.size),
                 line=dict(color=actor.color_rgba(0.8), width=1.0),
                 mode='lines+markers',
-                x=xx,  # [ x_prime(t,0.*t,u) for t in range(10)],
-                y=yy,  # [ t_prime(t,0.*t,u) for t in range(10)],
+                x=xx[i],  # [ x_prime(t,0.*t,u) for t in range(10)],
+                y=yy[i],  # [ t_prime(t,0.*t,u) for t in range(10)],
                 visible=False,
                 name="{}".format(actor.name),
                 # name="{} at u={:3.1f}".format(actor.name,u),
             ))
 
-            (x_grid, y_grid) = self.make_grid(rel_add_velocity(u, -actor.velocity))
             fig.add_trace(go.Scatter(
                 # marker=dict(color=actor.color, size=actor.size),
                 line=dict(color=actor.color_rgba(0.2), width=0.5),
                 mode='lines',
-                x=x_grid,
-                y=y_grid,
+                x=x_grids[i],
+                y=y_grids[i],
                 visible=False,
                 showlegend=False,
                 # name="A: for {} at u={:3.1f}".format(actor.name, u),
@@ -160,40 +195,33 @@ class MinkowsiPlot(object):
             ))
 
     def make_grid(self, beta):
+        """Make the grid of lines of constant x and constant t, seen from a frame moving with velocity beta.
+        Returns the x and y lists, with None between the lines."""
+        x_grids, y_grids = self.make_grids([beta])
+        return x_grids[0], y_grids[0]
+
+    def make_grids(self, betas):
+        """Make the grids for each of the velocities in betas at once. Returns two lists, with for each beta
+        the x or y list of make_grid()."""
 
         ngridsteps = 21 * 2
         z_min = -10 * 2
         z_max = 10 * 2
 
-        # Draw the vertical lines.
-        xx1 = []
-        yy1 = []
-        xx2 = []
-        yy2 = []
-
-        for i in range(ngridsteps):
-            xt = z_min + i
-            xx1.append(x_prime(z_min, xt, beta))
-            yy1.append(t_prime(z_min, xt, beta))
-            xx1.append(x_prime(z_max, xt, beta))
-            yy1.append(t_prime(z_max, xt, beta))
-            xx1.append(None)
-            yy1.append(None)
-
-            xx2.append(x_prime(xt, z_min, beta))
-            yy2.append(t_prime(xt, z_min, beta))
-            xx2.append(x_prime(xt, z_max, beta))
-            yy2.append(t_prime(xt, z_max, beta))
-            xx2.append(None)
-            yy2.append(None)
+        # The end points of the lines of constant x (vertical) and constant t (horizontal), both (ngridsteps, 2).
+        z = z_min + np.arange(ngridsteps, dtype=float)[:, np.newaxis]
+        ends = np.array([z_min, z_max], dtype=float)
+        t_lines = np.concatenate([np.broadcast_to(ends, (ngridsteps, 2)), np.broadcast_to(z, (ngridsteps, 2))])
+        x_lines = np.concatenate([np.broadcast_to(z, (ngridsteps, 2)), np.broadcast_to(ends, (ngridsteps, 2))])
 
         # xx2 = [z_min, z_max, None] * ngridsteps
         # yy2 = list(np.array([(x - (3 * ngridsteps // 2 - 1)) // 3 for x in range(3 * ngridsteps)]) +
         #            np.array([y0_min, y0_max, 0] * ngridsteps))
 
-        x_grid = xx1 + xx2
-        y_grid = yy1 + yy2
-        return x_grid, y_grid
+        betas = np.asarray(betas, dtype=float)
+        y_grid, x_grid = lorentz_boost(t_lines, x_lines, betas[:, np.newaxis, np.newaxis])
+        grids = [_line_segments(x_grid[i], y_grid[i]) for i in range(len(betas))]
+        return [g[0] for g in grids], [g[1] for g in grids]
 
     def add_slider(self):
         """Add the slider to the figure."""